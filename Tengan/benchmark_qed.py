@@ -0,0 +1,38 @@
+import time
+import argparse
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import QED
+from .mol_metrics import qed, qed_properties
+# ============================================================================
+# Benchmark mol_metrics.qed against rdkit.Chem.QED for agreement and speed
+# Usage: python -m Tengan.benchmark_qed --dataset Tengan/Dataset/ZINC.csv --num 5000
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset', type=str, default='Tengan/Dataset/ZINC.csv', help='CSV with SMILES in the first column')
+parser.add_argument('--num', type=int, default=5000, help='number of molecules to score')
+args = parser.parse_args()
+
+def timed(fn, smiles):
+    # Freshly parsed molecules, so no scorer reuses ring info cached by another
+    mols = [mol for mol in (Chem.MolFromSmiles(sm) for sm in smiles) if mol is not None]
+    start = time.perf_counter()
+    vals = [fn(mol) for mol in mols]
+    return np.array(vals, dtype=float), time.perf_counter() - start
+
+if __name__ == '__main__':
+    with open(args.dataset, 'r') as f:
+        smiles = [line.split(',')[0].strip() for line in f][:args.num]
+    mols = [mol for mol in (Chem.MolFromSmiles(sm) for sm in smiles) if mol is not None]
+    print('Molecules: {}'.format(len(mols)))
+
+    rdkit_vals, rdkit_time = timed(QED.qed, smiles)
+    same_vals, same_time = timed(lambda mol: qed(mol, gerebtzoff=False), smiles)
+    reward_vals, reward_time = timed(qed, smiles)
+
+    props_equal = sum(tuple(qed_properties(mol)[:8]) == tuple(QED.properties(mol)) for mol in mols)
+    print('Properties identical to QED.properties: {}/{}'.format(props_equal, len(mols)))
+    print('rdkit.Chem.QED.qed:        {:.3f}s  ({:.1f} us/mol)'.format(rdkit_time, rdkit_time / len(mols) * 1e6))
+    print('qed(gerebtzoff=False):     {:.3f}s  ({:.1f} us/mol)  max |diff| vs rdkit: {:.2e}'.format(
+        same_time, same_time / len(mols) * 1e6, np.abs(same_vals - rdkit_vals).max()))
+    print('qed() (reward, Gerebtzoff): {:.3f}s  ({:.1f} us/mol)  max |diff| vs rdkit: {:.2e}'.format(
+        reward_time, reward_time / len(mols) * 1e6, np.abs(reward_vals - rdkit_vals).max()))
@@ -0,0 +1,53 @@
+import time
+import argparse
+import torch
+from .mol_metrics import Tokenizer
+from .generator import GeneratorModel, GenSampler
+# ============================================================================
+# Benchmark GenSampler decoding speed (tokens/s) with eager and compiled incremental steps
+# Usage: python -m Tengan.benchmark_sampler --model_path <g_pretrained.pkl> --batch_sizes 1 8 64
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_path', type=str, default=None, help='generator state dict (random weights if omitted)')
+parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 64])
+parser.add_argument('--modes', type=str, nargs='+', default=['eager', 'script', 'compile'], help='eager, script (TorchScript) and/or compile (torch.compile)')
+parser.add_argument('--max_len', type=int, default=100, help='maximum SMILES length')
+parser.add_argument('--repeats', type=int, default=3, help='timed batches per batch size')
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+def count_tokens(tokenizer, smiles):
+    # Sampled tokens including the end token of each finished row
+    return int((tokenizer.encode_many(smiles, special=False) != 0).sum()) + len(smiles)
+
+if __name__ == '__main__':
+    tokenizer = Tokenizer()
+    tokenizer.build_vocab()
+    model = GeneratorModel(n_tokens=tokenizer.n_tokens, d_model=128, nhead=4, num_encoder_layers=4, dim_feedforward=1024, max_length=200)
+    if args.model_path:
+        model.load_state_dict(torch.load(args.model_path, map_location='cpu'), strict=True)
+    model.eval()
+    print('Threads: {}'.format(torch.get_num_threads()))
+
+    results = {}
+    for mode in args.modes:
+        sampler = GenSampler(model, tokenizer, batch_size=1, max_len=args.max_len, compact=True)
+        start = time.perf_counter()
+        if mode != 'eager' and not sampler.compile(mode):
+            continue
+        print('{}: warm-up {:.2f}s'.format(mode, time.perf_counter() - start))
+        for batch_size in args.batch_sizes:
+            sampler.batch_size = batch_size
+            torch.manual_seed(args.seed)
+            sampler.sample() # Untimed, so TorchScript profiling runs / torch.compile guards for this shape are done
+            tokens, start = 0, time.perf_counter()
+            for _ in range(args.repeats):
+                tokens += count_tokens(tokenizer, sampler.sample())
+            results[mode, batch_size] = tokens / (time.perf_counter() - start)
+
+    for batch_size in args.batch_sizes:
+        line = 'batch {:>3}:'.format(batch_size)
+        for mode in args.modes:
+            if (mode, batch_size) in results:
+                speedup = results[mode, batch_size] / results['eager', batch_size] if ('eager', batch_size) in results else float('nan')
+                line += '  {} {:8.0f} tok/s ({:.2f}x)'.format(mode, results[mode, batch_size], speedup)
+        print(line)
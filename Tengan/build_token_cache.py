@@ -0,0 +1,19 @@
+import time
+import argparse
+from .data_iter import build_token_cache
+# ============================================================================
+# Pre-tokenize a SMILES dataset for generator pretraining (see GenDataLoader(token_cache=...))
+# Usage: python -m Tengan.build_token_cache --dataset Tengan/Dataset/ZINC.csv --out Tengan/res/token_cache/ZINC --variants 4
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset', type=str, default='Tengan/Dataset/ZINC.csv', help='CSV with one SMILES per line')
+parser.add_argument('--out', type=str, default='Tengan/res/token_cache/ZINC', help='output directory of the token cache')
+parser.add_argument('--variants', type=int, default=4, help='the number of randomized SMILES stored per molecule')
+parser.add_argument('--nrows', type=int, default=None, help='only the first nrows molecules of the dataset')
+parser.add_argument('--seed', type=int, default=0, help='the seed of the atom order randomization')
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    kept, skipped = build_token_cache(args.dataset, args.out, args.variants, args.nrows, args.seed)
+    print('{} molecules x {} variants written to {} in {:.1f}s ({} invalid SMILES skipped)'.format(
+        kept, args.variants, args.out, time.perf_counter() - start, skipped))
@@ -1,15 +1,130 @@
 
+import os
+import json
 import torch
+import itertools
 import numpy as np
 import pandas as pd 
 from rdkit import Chem
 from rdkit import rdBase
 from .mol_metrics import Tokenizer
-from torch.utils.data import Dataset, DataLoader
+from .novelty import NoveltyIndex
+from torch.utils.data import Dataset, DataLoader, Sampler
 from pytorch_lightning import LightningDataModule
 rdBase.DisableLog('rdApp.error')
 
 
+# ============================================================================
+# Randomize the same molecules to different SMILES representations for sufficently training (c1cccc([N+]([O-])=O)c1 -> c1ccccc1[N+](=O)[O-])
+def randomize_mol_atom_order(mol, rng=np.random):
+    atom_idxs = list(range(mol.GetNumAtoms()))
+    rng.shuffle(atom_idxs)
+    mol = Chem.RenumberAtoms(mol,atom_idxs)
+    return Chem.MolToSmiles(mol, canonical=False)
+
+
+# ============================================================================
+# Offline preprocessing: tokenize n_variants randomized SMILES of every molecule once.
+# Sequence i * n_variants + k (variant k of molecule i) is tokens[offsets[r]:offsets[r+1]] for r = i * n_variants + k.
+def build_token_cache(positive_file, cache_dir, n_variants=1, nrows=None, seed=0):
+    """
+        positive_file: CSV of SMILES (one per line, no header)
+        cache_dir: output directory for tokens.npy, offsets.npy, smiles.txt and meta.json
+        n_variants: the number of randomized SMILES stored per molecule
+    """
+    tokenizer = Tokenizer()
+    tokenizer.build_vocab()
+    rng = np.random.RandomState(seed)
+    smiles, sequences, skipped = [], [], 0
+    for sm in pd.read_csv(positive_file, nrows = nrows, names = ['smiles'])['smiles']:
+        mol = Chem.MolFromSmiles(sm)
+        if mol is None:
+            skipped += 1
+            continue
+        smiles.append(sm)
+        sequences.extend(tokenizer.encode(randomize_mol_atom_order(mol, rng)) for _ in range(n_variants))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(seq) for seq in sequences], out=offsets[1:])
+    dtype = np.uint8 if len(tokenizer.tokenlist) <= 256 else np.uint16
+    tokens = np.lib.format.open_memmap(os.path.join(cache_dir, 'tokens.npy'), mode='w+', dtype=dtype, shape=(int(offsets[-1]),))
+    tokens[:] = np.fromiter(itertools.chain.from_iterable(sequences), dtype=dtype, count=int(offsets[-1]))
+    tokens.flush()
+    np.save(os.path.join(cache_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(cache_dir, 'smiles.txt'), 'w') as f:
+        f.write('\n'.join(smiles) + '\n')
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump({'source': positive_file, 'n_variants': n_variants, 'seed': seed, 'tokenlist': tokenizer.tokenlist}, f)
+    return len(smiles), skipped
+
+
+# The memory-mapped token cache written by build_token_cache
+class TokenCache():
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.n_variants = meta['n_variants']
+        self.tokenlist = meta['tokenlist']
+        self.tokens = np.load(os.path.join(cache_dir, 'tokens.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(cache_dir, 'offsets.npy'))
+        self.lengths = np.diff(self.offsets) # Length of every stored sequence
+        with open(os.path.join(cache_dir, 'smiles.txt'), 'r') as f:
+            self.smiles = f.read().split('\n')[:-1] # Source SMILES of every molecule
+
+    def __len__(self):
+        return len(self.smiles)
+
+    def sequence(self, row):
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+
+# Sequences of the token cache addressed by row, no tokenization at training time
+class TokenCacheDataset(Dataset):
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.cache.lengths)
+
+    def __getitem__(self, row):
+        return np.asarray(self.cache.sequence(row), dtype=np.int64)
+
+
+# Batches of similar lengths to minimize padding: every epoch picks one variant per molecule,
+# shuffles, sorts buckets of bucket_batches batches by length and shuffles the batch order
+class BucketBatchSampler(Sampler):
+
+    def __init__(self, lengths, molecules, n_variants, batch_size, shuffle=True, bucket_batches=50, seed=None):
+        self.lengths = lengths
+        self.molecules = np.asarray(molecules)
+        self.n_variants = n_variants
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_batches
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return (len(self.molecules) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            rows = self.molecules * self.n_variants + self.rng.randint(self.n_variants, size=len(self.molecules))
+            rows = rows[self.rng.permutation(len(rows))]
+        else: # The first variant in the given order
+            rows = self.molecules * self.n_variants
+        batches = []
+        for start in range(0, len(rows), self.bucket_size):
+            bucket = rows[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        order = self.rng.permutation(len(batches)) if self.shuffle else range(len(batches))
+        for i in order:
+            yield batches[i].tolist()
+
+
 # ============================================================================
 # Build a dataset, inherited the methods of Dataset, that returns tensors for Genenerator
 class GenDataset(Dataset):
@@ -22,41 +137,43 @@ class GenDataset(Dataset):
         return len(self.data)
     
     def __getitem__(self, idx):
-        smile = self.data[idx]
-        tensor = self.tokenizer.encode(smile)
-        return tensor
+        # Tokenized per batch by the collate function
+        return self.data[idx]
 
 
 # ============================================================================
 # Definite the data loader for Generator
 class GenDataLoader(LightningDataModule):
 
-    def __init__(self, positive_file, train_size=4800, batch_size=64):
+    def __init__(self, positive_file, train_size=4800, batch_size=64, token_cache=None):
         super().__init__()
         self.tokenizer = Tokenizer()
         self.train_size = train_size
         self.val_size = 200
         self.batch_size = batch_size
         self.positive_file = positive_file
+        self.token_cache = token_cache # Directory written by build_token_cache; None tokenizes positive_file on the fly
     
-    # Randomize the same molecules to different SMILES representations for sufficently training (c1cccc([N+]([O-])=O)c1 -> c1ccccc1[N+](=O)[O-])
     def randomize_smiles_atom_order(self, smiles):
-        mol = Chem.MolFromSmiles(smiles)
-        atom_idxs = list(range(mol.GetNumAtoms()))
-        np.random.shuffle(atom_idxs)
-        mol = Chem.RenumberAtoms(mol,atom_idxs)
-        return Chem.MolToSmiles(mol, canonical=False)
+        return randomize_mol_atom_order(Chem.MolFromSmiles(smiles))
     
     def custom_collate_and_pad(self, batch):
-        # Batch is a list of vectorized smiles
-        tensors = [torch.tensor(l) for l in batch]
+        # Batch is a list of smiles, padded to the maximum length (each column is a sequence)
+        return torch.from_numpy(self.tokenizer.encode_many(batch)).t().contiguous() # [maxlength, batch_size]
+
+    def collate_token_rows(self, batch):
+        # Batch is a list of token arrays from the token cache
+        tensors = [torch.from_numpy(l) for l in batch]
         # Pad the different lengths of tensors to the maximum length (each column is a sequence)
         tensors = torch.nn.utils.rnn.pad_sequence(tensors) # [maxlength, batch_size]
         return tensors
     
     def setup(self):
+        if self.token_cache is not None:
+            return self.setup_token_cache()
         # Load data
         self.data = pd.read_csv(self.positive_file, nrows = self.val_size + self.train_size, names = ['smiles'])
+        source = self.data['smiles'].copy()
         # Atom order randomize SMILES
         self.data['smiles'] = self.data['smiles'].apply(self.randomize_smiles_atom_order)
         # Initialize Tokenizer
@@ -69,13 +186,37 @@ class GenDataLoader(LightningDataModule):
         self.train_data.reset_index(drop=True, inplace=True)
         self.val_data = self.data['smiles'][val_idxs]
         self.val_data.reset_index(drop=True, inplace=True)
+        # Canonical SMILES of the training split for the novelty check
+        self.train_canonical = NoveltyIndex.for_dataset(self.positive_file).subset(source[train_idxs])
+
+    def setup_token_cache(self):
+        self.cache = TokenCache(self.token_cache)
+        self.tokenizer.build_vocab()
+        if self.cache.tokenlist != self.tokenizer.tokenlist:
+            raise ValueError('The token cache {} was built with a different vocabulary'.format(self.token_cache))
+        # Create splits for train/val over molecules (every variant of a molecule stays in its split)
+        idxs = np.array(range(min(len(self.cache), self.val_size + self.train_size)))
+        np.random.shuffle(idxs)
+        self.val_mols, self.train_mols = idxs[:self.val_size], idxs[self.val_size:self.val_size + self.train_size]
+        self.train_data = pd.Series([self.cache.smiles[i] for i in self.train_mols])
+        self.val_data = pd.Series([self.cache.smiles[i] for i in self.val_mols])
+        self.train_canonical = NoveltyIndex.for_dataset(self.positive_file).subset(self.train_data)
+
+    def token_cache_dataloader(self, molecules, shuffle):
+        sampler = BucketBatchSampler(self.cache.lengths, molecules, self.cache.n_variants, self.batch_size, shuffle=shuffle)
+        # Items are slices of the memory map, so worker processes would only add overhead
+        return DataLoader(TokenCacheDataset(self.cache), batch_sampler=sampler, pin_memory=True, collate_fn=self.collate_token_rows, num_workers=0)
         
     def train_dataloader(self):
+        if self.token_cache is not None:
+            return self.token_cache_dataloader(self.train_mols, shuffle=True)
         dataset = GenDataset(self.train_data, self.tokenizer)
         # pin_memory=True: speed the dataloading, num_workers: multithreading for dataloading
         return DataLoader(dataset, batch_size=self.batch_size, pin_memory=True, collate_fn=self.custom_collate_and_pad, num_workers=40) 
     
     def val_dataloader(self):
+        if self.token_cache is not None:
+            return self.token_cache_dataloader(self.val_mols, shuffle=False)
         dataset = GenDataset(self.val_data, self.tokenizer)
         return DataLoader(dataset, batch_size=self.batch_size, pin_memory=True, collate_fn=self.custom_collate_and_pad, shuffle=False, num_workers=40)
 
@@ -92,11 +233,8 @@ class DisDataset(Dataset):
         return len(self.data)
     
     def __getitem__(self, idx):
-        smile = self.data[idx]
-        # Remove the start token and end token
-        tensor = self.tokenizer.encode(smile)[1:-1] 
-        label = self.labels[idx]
-        return tensor, label
+        # Tokenized per batch by the collate function
+        return self.data[idx], self.labels[idx]
 
 
 # ============================================================================
@@ -113,10 +251,8 @@ class DisDataLoader(LightningDataModule):
     def custom_collate_and_pad(self, batch):
         # Zip a batch of data
         smiles, labels = zip(*batch) 
-        # Batch is a list of vectorized smiles
-        tensors = [torch.LongTensor(smi) for smi in smiles]
-        # Pad the different lengths of tensors to the maximum length (each column is a sequence)
-        tensors = torch.nn.utils.rnn.pad_sequence(tensors).transpose(0, 1) # [batch_size, maxlength]
+        # Remove the start token and end token, pad the different lengths to the maximum length
+        tensors = torch.from_numpy(self.tokenizer.encode_many(smiles, special=False)) # [batch_size, maxlength]
         labels = torch.LongTensor(labels)
         return tensors, labels
     
@@ -0,0 +1,124 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from rdkit.Chem import Crippen, Descriptors
+from .fingerprints import fingerprint_cache
+from .mol_metrics import druglikeness, solubility, synthesizability
+# ============================================================================
+# Descriptor engine: parse each SMILES once, compute the requested descriptors in chunks
+# (in a process pool for large batches) and return one NumPy column per descriptor.
+# Every descriptor takes (smiles, mol) with mol already parsed (never None).
+DESCRIPTORS = {
+    'druglikeness': lambda sm, mol: druglikeness(mol),
+    'solubility': lambda sm, mol: solubility(mol),
+    'synthesizability': lambda sm, mol: synthesizability(mol, fingerprint_cache.morgan_counts(sm, 2)) if sm != '' else 0.0,
+    'molecular_weight': lambda sm, mol: Descriptors.MolWt(mol),
+    'logp': lambda sm, mol: Crippen.MolLogP(mol),
+    'hbd': lambda sm, mol: Descriptors.NumHDonors(mol),
+    'hba': lambda sm, mol: Descriptors.NumHAcceptors(mol),
+    'rotatable_bonds': lambda sm, mol: Descriptors.NumRotatableBonds(mol),
+    'aromatic_rings': lambda sm, mol: Descriptors.NumAromaticRings(mol),
+    'tpsa': lambda sm, mol: Descriptors.TPSA(mol),
+}
+# Score of an unparseable SMILES for the reward properties (matches the batch_* functions)
+INVALID_SCORES = {'druglikeness': 0.0, 'solubility': 0.0, 'synthesizability': 0.0}
+
+def _compute_chunk(args):
+    smiles, names = args
+    columns = {name: np.full(len(smiles), INVALID_SCORES.get(name, np.nan)) for name in names}
+    valid = np.zeros(len(smiles), dtype=bool)
+    for i, sm in enumerate(smiles):
+        mol = fingerprint_cache.mol(sm)
+        if mol is None:
+            continue
+        valid[i] = True
+        for name in names:
+            # Only an unparseable SMILES scores as invalid; a descriptor raising on a parsed Mol is a bug and propagates
+            columns[name][i] = DESCRIPTORS[name](sm, mol)
+    columns['valid'] = valid
+    return columns
+
+class DescriptorEngine():
+
+    def __init__(self, n_jobs=None, chunk_size=256, parallel_threshold=1024):
+        self.n_jobs = n_jobs or int(os.environ.get('DESCRIPTOR_WORKERS', os.cpu_count() or 1))
+        self.chunk_size = chunk_size
+        self.parallel_threshold = parallel_threshold
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created once under a lock (compute runs from several server threads); spawned workers
+        # instead of forked ones, since forking a process that already runs threads is unsafe
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.n_jobs, mp_context=mp.get_context('spawn'))
+            return self._executor
+
+    def compute(self, smiles, names):
+        """Dict of descriptor name -> float64 array (plus a boolean 'valid' column), in input order."""
+        smiles = list(smiles)
+        names = list(names)
+        unknown = [name for name in names if name not in DESCRIPTORS]
+        if unknown:
+            raise ValueError('Unknown descriptors: {}'.format(unknown))
+        if len(smiles) < self.parallel_threshold or self.n_jobs == 1:
+            return _compute_chunk((smiles, names))
+
+        chunks = [(smiles[i:i + self.chunk_size], names) for i in range(0, len(smiles), self.chunk_size)]
+        results = list(self._pool().map(_compute_chunk, chunks))
+        return {name: np.concatenate([r[name] for r in results]) for name in names + ['valid']}
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+descriptor_engine = DescriptorEngine()
+
+# ============================================================================
+# Bounded memo of property scores keyed by (property, SMILES), shared by every rollout of a run
+class RewardCache():
+
+    def __init__(self, engine=None, maxsize=200000):
+        self.engine = engine or descriptor_engine
+        self.maxsize = maxsize
+        self._scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def score(self, properties, smiles):
+        """Scores of `properties` for each SMILES as a float array; only unseen SMILES reach RDKit."""
+        vals = np.empty(len(smiles))
+        missing = {}
+        for i, sm in enumerate(smiles):
+            key = (properties, sm)
+            if key in self._scores:
+                self._scores.move_to_end(key)
+                vals[i] = self._scores[key]
+                self.hits += 1
+            else:
+                missing.setdefault(sm, []).append(i)
+                self.misses += 1
+        if missing:
+            computed = self.engine.compute(list(missing), [properties])[properties]
+            for (sm, idx), val in zip(missing.items(), computed):
+                vals[idx] = val
+                self._scores[(properties, sm)] = val
+            while len(self._scores) > self.maxsize:
+                self._scores.popitem(last=False)
+        return vals
+
+    def epoch_stats(self, reset=True):
+        """Hit/miss counts since the last reset (call once per epoch)."""
+        lookups = self.hits + self.misses
+        stats = {'hits': self.hits, 'misses': self.misses, 'entries': len(self._scores),
+                 'hit_rate': self.hits / lookups if lookups else 0.0}
+        if reset:
+            self.hits = 0
+            self.misses = 0
+        return stats
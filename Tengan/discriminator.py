@@ -118,11 +118,16 @@ class DiscriminatorModel(LightningModule):
         return ave
 
     # Apply mini-batch discrimination to alleviate the mode-collapse problem
-    def minibatch_std(self, x):
+    def minibatch_std(self, x, group_size=None):
         """
             x: output of the middle layer of Discriminator with size [batch_size, d_model]
+            group_size: if given, the std is taken within each block of group_size consecutive rows
             return: contains the mean of the std information of x
         """
+        if group_size is not None:
+            grouped = x.view(-1, group_size, x.size(1)) # [n_groups, group_size, d_model]
+            mean = torch.std(grouped, dim=1, unbiased=False).mean(dim=1) # [n_groups]
+            return torch.cat((x, mean.repeat_interleave(group_size).unsqueeze(1)), dim=1) # [batch_size, d_model+1]
         size = list(x.size())
         size[1] = 1
         # Compute std according to the batch_size direction
@@ -131,16 +136,31 @@ class DiscriminatorModel(LightningModule):
 
         return torch.cat((x, mean.repeat(size)), dim=1) # [batch_size, d_model+1]
     
-    def forward(self, features): #[batch_size, maxlength]
+    def forward(self, features, group_size=None): #[batch_size, maxlength]
+        """
+            group_size: score each block of group_size consecutive rows as if it were a batch on its own,
+                        so many rollout batches share one call with the same outputs as separate calls
+        """
         paded_mask = self.padding_mask(features)
         embedded = self.embedding(features) * math.sqrt(self.d_model) #[batch_size, maxlength, d_model]
-        positional_encoded = self.positional_encoder(embedded) #[batch_size, maxlength, d_model]
-        encoded = self.encoder(positional_encoded) # [batch_size, maxlength, d_model]
+        if group_size is None:
+            positional_encoded = self.positional_encoder(embedded) #[batch_size, maxlength, d_model]
+            encoded = self.encoder(positional_encoded) # [batch_size, maxlength, d_model]
+        else:
+            # The encoder attends along the first dimension, so fold the groups into the second one
+            batch_size, maxlength, d_model = embedded.shape
+            n_groups = batch_size // group_size
+            grouped = embedded.view(n_groups, group_size, maxlength, d_model).transpose(0, 1).reshape(group_size, n_groups * maxlength, d_model)
+            # Positions that are padding in every row of their group do not reach the masked mean
+            used = (features != self.pad_token).view(n_groups, group_size, maxlength).any(dim=1).reshape(-1) # [n_groups*maxlength]
+            encoded = torch.zeros_like(grouped)
+            encoded[:, used] = self.encoder(self.positional_encoder(grouped[:, used])) # [group_size, n_groups*maxlength, d_model]
+            encoded = encoded.view(group_size, n_groups, maxlength, d_model).transpose(0, 1).reshape(batch_size, maxlength, d_model)
         masked_out = self.masked_mean(encoded, paded_mask) # [batch_size, d_model]
 
         # If true: apply mini-batch discriminator
         if self.minibatch:
-            masked_out = self.minibatch_std(masked_out)
+            masked_out = self.minibatch_std(masked_out, group_size)
         # If true: apply WGAN
         if self.dis_wgan:
             weight_loss = torch.sum(self.classifier.weight**2) / 2.
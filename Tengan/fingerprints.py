@@ -0,0 +1,96 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from rdkit import Chem
+from rdkit import DataStructs
+from rdkit.Chem import rdFingerprintGenerator
+# ============================================================================
+# Shared Mol / Morgan fingerprint cache
+# Mols are cached per input SMILES; fingerprints per canonical SMILES and (type, radius, size),
+# so different spellings of the same molecule share one fingerprint.
+class FingerprintCache():
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generators = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def _parse(self, smiles):
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            return None, None
+        return mol, Chem.MolToSmiles(mol)
+
+    def parse(self, smiles):
+        """(Mol, canonical SMILES) for a SMILES string, (None, None) if it does not parse."""
+        return self._get(('mol', smiles), lambda: self._parse(smiles))
+
+    def mol(self, smiles):
+        # Returned Mols are shared; callers must not modify them
+        return self.parse(smiles)[0]
+
+    def canonical(self, smiles):
+        return self.parse(smiles)[1]
+
+    def generator(self, radius, fp_size):
+        with self._lock:
+            if (radius, fp_size) not in self._generators:
+                self._generators[(radius, fp_size)] = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=fp_size)
+            return self._generators[(radius, fp_size)]
+
+    def morgan(self, smiles, radius=2, fp_size=2048):
+        """Folded Morgan bit vector (ExplicitBitVect), or None for invalid SMILES."""
+        mol, canonical = self.parse(smiles)
+        if mol is None:
+            return None
+        return self._get(('bits', canonical, radius, fp_size),
+                         lambda: self.generator(radius, fp_size).GetFingerprint(mol))
+
+    def morgan_counts(self, smiles, radius=2):
+        """Unfolded Morgan count fingerprint (UIntSparseIntVect), or None for invalid SMILES."""
+        mol, canonical = self.parse(smiles)
+        if mol is None:
+            return None
+        return self._get(('counts', canonical, radius),
+                         lambda: self.generator(radius, 2048).GetSparseCountFingerprint(mol))
+
+    def morgan_numpy(self, smiles, radius=2, fp_size=2048):
+        fp = self.morgan(smiles, radius, fp_size)
+        if fp is None:
+            return None
+        arr = np.zeros((fp_size,), dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(fp, arr)
+        return arr
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None}
+
+fingerprint_cache = FingerprintCache(maxsize=int(os.environ.get('FP_CACHE_SIZE', 50000)))
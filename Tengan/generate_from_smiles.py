@@ -1,5 +1,8 @@
+import os
 import json
 import torch
+import numpy as np
+import threading
 
 try:
     from .mol_metrics import Tokenizer
@@ -9,7 +12,7 @@ except ImportError:
     from generator import GeneratorModel, GenSampler
 
 class MoleculeGenerator:
-    def __init__(self, model_path: str, batch_size: int = 64, max_len: int = 70):
+    def __init__(self, model_path: str, batch_size: int = 64, max_len: int = 70, compile_mode: str = None):
         self.tokenizer = Tokenizer()
         self.tokenizer.build_vocab()
         n_tokens = self.tokenizer.n_tokens
@@ -30,32 +33,41 @@ class MoleculeGenerator:
             model=self.model,
             tokenizer=self.tokenizer,
             batch_size=batch_size,
-            max_len=max_len
+            max_len=max_len,
+            compact=True
         )
+        # Compiled decoding ('script', 'compile', or 'eager' to disable), warmed up here so requests never pay for it
+        compile_mode = compile_mode or os.environ.get("GENERATOR_COMPILE", "script")
+        if compile_mode != "eager":
+            self.sampler.compile(compile_mode)
+        # The model and sampler are shared by concurrent discovery jobs; sampling toggles train/eval mode
+        self._lock = threading.Lock()
     
     def generate(self, num_samples: int):
-        return self.sampler.sample_multi(num_samples)
+        with self._lock:
+            return self.sampler.sample_multi(num_samples)
     
     def generate_from_smiles(self, input_smiles: str, num_samples: int):
-        encoded_smiles = self.tokenizer.encode(input_smiles)
-        encoded_tensor = torch.tensor(encoded_smiles, dtype=torch.long).unsqueeze(1)
+        return self.generate_from_many([input_smiles], num_samples)[0]
 
-        # make encoded tensor have shape [len, batch_size] and fit max_len
-        if encoded_tensor.size(1) != self.sampler.batch_size:
-            if encoded_tensor.size(1) == 1:
-                encoded_tensor = encoded_tensor.repeat(1, self.sampler.batch_size)
-            elif encoded_tensor.size(1) < self.sampler.batch_size:
-                reps = (self.sampler.batch_size // encoded_tensor.size(1)) + 1
-                encoded_tensor = encoded_tensor.repeat(1, reps)[:, :self.sampler.batch_size]
-            else:
-                encoded_tensor = encoded_tensor[:, :self.sampler.batch_size]
+    def generate_from_many(self, smiles_list, n_per_seed: int, max_rows: int = 512):
+        """Sample n_per_seed continuations of every SMILES in smiles_list; returns one list per seed.
 
-        if encoded_tensor.size(0) > self.sampler.max_len:
-            encoded_tensor = encoded_tensor[:self.sampler.max_len, :]
+        Seeds of different lengths are packed into the same batch: each row keeps its own
+        (start-to-end token) prefix and is sampled from there, up to max_rows rows per decoding loop.
+        """
+        if not smiles_list or n_per_seed <= 0:
+            return [[] for _ in smiles_list]
+        encoded = self.tokenizer.encode_many(smiles_list)[:, :self.sampler.max_len] # [n_seeds, len]
+        end_token = self.tokenizer.char_to_int[self.tokenizer.end]
+        has_end = (encoded == end_token).any(axis=1)
+        prefix_lens = np.where(has_end, (encoded == end_token).argmax(axis=1) + 1, encoded.shape[1])
+        data = torch.from_numpy(encoded).t().contiguous() # [len, n_seeds]
 
+        columns = np.repeat(np.arange(len(smiles_list)), n_per_seed)
         samples = []
-        for _ in range(int(num_samples / self.sampler.batch_size) + (1 if num_samples % self.sampler.batch_size != 0 else 0)):
-            batch_sample = self.sampler.sample(data=encoded_tensor)
-            samples.extend(batch_sample)
-
-        return samples[:num_samples]
\ No newline at end of file
+        for start in range(0, len(columns), max_rows):
+            rows = columns[start:start + max_rows]
+            with self._lock:
+                samples.extend(self.sampler.sample_prefixes(data, prefix_lens[rows], rows))
+        return [samples[i * n_per_seed:(i + 1) * n_per_seed] for i in range(len(smiles_list))]
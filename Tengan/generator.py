@@ -1,6 +1,8 @@
 
 import math
 import torch
+import warnings
+from typing import List
 from tqdm import tqdm
 import pytorch_lightning
 from pytorch_lightning import LightningModule
@@ -122,45 +124,300 @@ class GeneratorModel(LightningModule):
         return loss
 
 
+# ============================================================================
+# Keys / values of the already-decoded prefix, one pair of buffers per encoder layer
+class KVCache():
+    def __init__(self, num_layers, max_len, batch_size, d_model, device):
+        self.keys = [torch.zeros((max_len, batch_size, d_model), device=device) for _ in range(num_layers)]
+        self.values = [torch.zeros((max_len, batch_size, d_model), device=device) for _ in range(num_layers)]
+        self.length = 0 # The number of positions already cached
+
+    def select(self, rows):
+        # Keep only the given batch rows (index or boolean mask), e.g. after finished sequences are dropped
+        self.keys = [k[:, rows] for k in self.keys]
+        self.values = [v[:, rows] for v in self.values]
+
+
+def _cached_self_attention(attn, x, keys, values, start, mask):
+    """
+        attn: the torch.nn.MultiheadAttention of an encoder layer
+        x: the new positions with the shape [new_len, batch_size, d_model]
+        keys, values: the cache buffers of this layer, written in place at [start:start+new_len]
+    """
+    new_len, batch_size, d_model = x.shape
+    end = start + new_len
+    head_dim = d_model // attn.num_heads
+    q, k, v = torch.nn.functional.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+    keys[start:end] = k
+    values[start:end] = v
+    split = lambda t: t.reshape(t.shape[0], batch_size, attn.num_heads, head_dim).permute(1, 2, 0, 3) # [batch_size, nhead, len, head_dim]
+    out = torch.nn.functional.scaled_dot_product_attention(split(q), split(keys[:end]), split(values[:end]), attn_mask=mask)
+    out = out.permute(2, 0, 1, 3).reshape(new_len, batch_size, d_model)
+    return attn.out_proj(out)
+
+
+def _cached_layer_forward(layer, x, keys, values, start, mask):
+    # Same computation as torch.nn.TransformerEncoderLayer, but attending over the cached prefix
+    ff = lambda t: layer.dropout2(layer.linear2(layer.dropout(layer.activation(layer.linear1(t)))))
+    if layer.norm_first:
+        x = x + layer.dropout1(_cached_self_attention(layer.self_attn, layer.norm1(x), keys, values, start, mask))
+        x = x + ff(layer.norm2(x))
+    else:
+        x = layer.norm1(x + layer.dropout1(_cached_self_attention(layer.self_attn, x, keys, values, start, mask)))
+        x = layer.norm2(x + ff(x))
+    return x
+
+
+def incremental_forward(model, features, cache, offsets=None, step=None):
+    """
+        Run the generator on the newest positions only, reusing the cached keys/values of the prefix.
+        model: GeneratorModel or OwnModel (embedding -> positional_encoder -> encoder -> fc_out)
+        features: the new tokens with the shape [new_len, batch_size]
+        cache: a KVCache holding cache.length positions, extended in place by new_len
+        offsets: for left-padded rows, the number of padding positions in front of each row, [batch_size]
+        step: a compiled IncrementalStep of the model (see compile_incremental), None for eager
+    """
+    start, new_len = cache.length, features.shape[0]
+    end = start + new_len
+    # The new position p attends to every cached position and to the new positions up to p
+    mask = torch.ones((new_len, end), dtype=torch.bool, device=features.device).tril(diagonal=start)
+    if offsets is None:
+        pe = model.positional_encoder.pe[start:end]
+    else: # Positions count from the first real token of each row, and the padding in front is never attended
+        positions = torch.arange(start, end, device=features.device)
+        pe = model.positional_encoder.pe[(positions[:, None] - offsets[None, :]).clamp(min=0), 0] # [new_len, batch_size, d_model]
+        key_positions = torch.arange(end, device=features.device)
+        # A padding query only sees itself, so its (unused) output stays finite
+        visible = (key_positions[None, None, :] >= offsets[:, None, None]) | (key_positions[None, None, :] == positions[None, :, None])
+        mask = (mask[None] & visible)[:, None] # [batch_size, 1, new_len, end]
+    if step is not None:
+        logits = step(features, pe, cache.keys, cache.values, start, mask)
+        cache.length = end
+        return logits
+    embedded = model.embedding(features)
+    x = model.positional_encoder.dropout(embedded + pe)
+    for layer, keys, values in zip(model.encoder.layers, cache.keys, cache.values):
+        x = _cached_layer_forward(layer, x, keys, values, start, mask)
+    if model.encoder.norm is not None:
+        x = model.encoder.norm(x)
+    cache.length = end
+    return model.fc_out(x) # [new_len, batch_size, vocab_size]
+
+
+# ============================================================================
+# The layer stack of incremental_forward as one module that TorchScript / torch.compile can optimize,
+# so decoding does not pay Python dispatch per layer per token. Inference only: dropout is skipped.
+class IncrementalStep(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        layers = model.encoder.layers
+        activation = layers[0].activation
+        if activation in (torch.nn.functional.relu, torch.relu) or isinstance(activation, torch.nn.ReLU):
+            self.gelu = False
+        elif activation is torch.nn.functional.gelu or isinstance(activation, torch.nn.GELU):
+            self.gelu = True
+        else:
+            raise ValueError('Unsupported encoder activation: {}'.format(activation))
+        self.norm_first = bool(layers[0].norm_first)
+        self.nhead = layers[0].self_attn.num_heads
+        self.embedding = model.embedding
+        self.layers = layers
+        self.norm = model.encoder.norm if model.encoder.norm is not None else torch.nn.Identity()
+        self.fc_out = model.fc_out
+
+    def forward(self, features: torch.Tensor, pe: torch.Tensor, keys: List[torch.Tensor], values: List[torch.Tensor],
+                start: int, mask: torch.Tensor) -> torch.Tensor:
+        x = self.embedding(features) + pe
+        new_len, batch_size, d_model = x.shape
+        end = start + new_len
+        head_dim = d_model // self.nhead
+        i = 0
+        for layer in self.layers: # Same computation as _cached_layer_forward
+            h = layer.norm1(x) if self.norm_first else x
+            q, k, v = torch.nn.functional.linear(h, layer.self_attn.in_proj_weight, layer.self_attn.in_proj_bias).chunk(3, dim=-1)
+            keys[i][start:end] = k
+            values[i][start:end] = v
+            q = q.reshape(new_len, batch_size, self.nhead, head_dim).permute(1, 2, 0, 3)
+            k = keys[i][:end].reshape(end, batch_size, self.nhead, head_dim).permute(1, 2, 0, 3)
+            v = values[i][:end].reshape(end, batch_size, self.nhead, head_dim).permute(1, 2, 0, 3)
+            h = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+            h = layer.self_attn.out_proj(h.permute(2, 0, 1, 3).reshape(new_len, batch_size, d_model))
+            x = x + h if self.norm_first else layer.norm1(x + h)
+
+            h = layer.linear1(layer.norm2(x) if self.norm_first else x)
+            h = layer.linear2(torch.nn.functional.gelu(h) if self.gelu else torch.relu(h))
+            x = x + h if self.norm_first else layer.norm2(x + h)
+            i += 1
+        return self.fc_out(self.norm(x))
+
+
+def compile_incremental(model, mode='script'):
+    """
+        mode: 'script' (TorchScript, no recompilation across batch sizes and lengths)
+              or 'compile' (torch.compile with dynamic shapes, needs a C++ compiler on CPU; recompiles for new
+              batch-size classes and falls back to eager once dynamo's recompile limit is hit)
+    """
+    step = IncrementalStep(model).eval()
+    if mode == 'script':
+        with warnings.catch_warnings(): # Deprecated in recent torch releases, but still the fastest option here
+            warnings.filterwarnings('ignore', category=FutureWarning)
+            return torch.jit.script(step)
+    if mode == 'compile':
+        return torch.compile(step, dynamic=True)
+    raise ValueError('Unknown compile mode: {}'.format(mode))
+
+
 # ============================================================================
 # Sampling "n" likely-SMILES from the GeneratorModel
 class GenSampler():
-    def __init__(self, model, tokenizer, batch_size, max_len):
+    def __init__(self, model, tokenizer, batch_size, max_len, use_cache=True, compact=False, compile_mode=None):
         self.model = model
         self.tokenizer = tokenizer
         self.batch_size = batch_size
         self.max_len = max_len
+        self.use_cache = use_cache # Incremental decoding: only the newest position is computed at each step
+        self.compact = compact # Drop finished sequences from the forward pass (changes the random stream, not the distribution)
+        self.step = None # Compiled IncrementalStep used by incremental decoding, None for eager
+        if compile_mode and use_cache:
+            self.compile(compile_mode)
+
+    def compile(self, mode='script', tolerance=1e-4):
+        """
+            Decode with a compiled IncrementalStep ('script' or 'compile', see compile_incremental).
+            A warm-up decode checks it against eager; any failure leaves the sampler on eager.
+        """
+        self.model.eval()
+        try:
+            step = compile_incremental(self.model, mode)
+            device = self.model.device
+            layers, d_model = len(self.model.encoder.layers), self.model.d_model
+            features = torch.randint(3, self.model.n_tokens, (6, 2), device=device)
+            offsets = torch.tensor([0, 2], device=device)
+            with torch.no_grad():
+                # Prefill and single-token steps, with and without left padding, so later calls are already optimized
+                for row_offsets in (None, offsets, None, offsets):
+                    eager_cache = KVCache(layers, len(features), 2, d_model, device)
+                    step_cache = KVCache(layers, len(features), 2, d_model, device)
+                    for start, end in ((0, 3), (3, 4), (4, 5), (5, 6)):
+                        expected = incremental_forward(self.model, features[start:end], eager_cache, row_offsets)
+                        logits = incremental_forward(self.model, features[start:end], step_cache, row_offsets, step)
+                        if not torch.allclose(logits, expected, atol=tolerance):
+                            raise RuntimeError('compiled logits differ from eager by {:.2e}'.format((logits - expected).abs().max()))
+            self.step = step
+        except Exception as e:
+            print('Compiled decoding ({}) unavailable, using eager: {}'.format(mode, e))
+            self.step = None
+        self.model.train()
+        return self.step is not None
+
+    def _incremental(self, features, cache, offsets=None):
+        if self.step is not None:
+            try:
+                return incremental_forward(self.model, features, cache, offsets, self.step)
+            except Exception as e: # e.g. an input the compiled step cannot handle: stay on eager from now on
+                print('Compiled decoding failed, using eager: {}'.format(e))
+                self.step = None
+        return incremental_forward(self.model, features, cache, offsets)
 
     # Sampling a batch of samples by the trained generator
     def sample(self, data=None):
-        self.model.eval()
-        finished = [False] * self.batch_size # Judge whether each sequence in a batch is finished according to the tokenizer.end
         sample_tensor = torch.zeros((self.max_len, self.batch_size), dtype=torch.long).to(self.model.device)
         sample_tensor[0] = self.tokenizer.char_to_int[self.tokenizer.start] # The first token is the start char
+        if data is None: # Generate SMILES according to the pre-trained Generator
+            init = 1
+        else: # Generate sub-SMILES according to the rollout function
+            sample_tensor[:len(data)] = data # [max_len, batch_size]
+            init = len(data)
+        prefix_lens = torch.full((self.batch_size,), init, dtype=torch.long, device=sample_tensor.device)
+        return self._decode(sample_tensor, prefix_lens)
+
+    # Complete every row after its own prefix length, all rows in one decoding loop
+    def sample_prefixes(self, data, prefix_lens, columns=None):
+        """
+            data: sub-SMILES with the shape [len, m]
+            prefix_lens: the number of leading tokens of its column kept for each row, [n]
+            columns: the column of data each row starts from, [n] (default: row i uses column i)
+        """
+        device = self.model.device
+        prefix_lens = torch.as_tensor(prefix_lens, dtype=torch.long, device=device)
+        columns = torch.arange(data.shape[1]) if columns is None else torch.as_tensor(columns, dtype=torch.long)
+        columns = columns.to(device)
+        data = data.to(device)
+        if not self.use_cache: # Shorter prefixes start sampling first, longer ones keep their own tokens meanwhile
+            sample_tensor = torch.zeros((self.max_len, len(columns)), dtype=torch.long, device=device)
+            sample_tensor[:len(data)] = data[:self.max_len, columns]
+            sample_tensor.masked_fill_(torch.arange(self.max_len, device=device)[:, None] >= prefix_lens[None, :], 0)
+            return self._decode(sample_tensor, prefix_lens)
+
+        # Left-pad every row so all prefixes end together: row r holds its prefix at [offsets[r], longest)
+        longest = int(prefix_lens.max())
+        offsets = longest - prefix_lens
+        source = (torch.arange(longest, device=device)[:, None] - offsets[None, :]).clamp(min=0) # [longest, n]
+        sample_tensor = torch.zeros((self.max_len + int(offsets.max()), len(columns)), dtype=torch.long, device=device)
+        sample_tensor[:longest] = data[source, columns[None, :]].masked_fill(torch.arange(longest, device=device)[:, None] < offsets[None, :], 0)
+        cache = KVCache(len(self.model.encoder.layers), len(sample_tensor), len(columns), self.model.d_model, device)
+        if longest > 1:
+            # Rows share the prefixes of a few columns: encode those once and gather their keys/values
+            self.model.eval()
+            with torch.no_grad():
+                shared = KVCache(len(self.model.encoder.layers), longest - 1, data.shape[1], self.model.d_model, device)
+                self._incremental(data[:longest - 1], shared)
+            for keys, values, shared_keys, shared_values in zip(cache.keys, cache.values, shared.keys, shared.values):
+                keys[:longest - 1] = shared_keys[source[:longest - 1], columns[None, :]]
+                values[:longest - 1] = shared_values[source[:longest - 1], columns[None, :]]
+            cache.length = longest - 1
+        return self._decode(sample_tensor, prefix_lens, cache, offsets)
+
+    def _decode(self, sample_tensor, prefix_lens, cache=None, offsets=None):
+        """
+            sample_tensor: [len, batch_size], the prefixes filled in
+            offsets: None if every prefix starts at position 0, else the left padding of each row
+        """
+        self.model.eval()
+        end_token = self.tokenizer.char_to_int[self.tokenizer.end]
+        batch_size = sample_tensor.shape[1]
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=sample_tensor.device) # Judge whether each sequence in a batch is finished according to the tokenizer.end
+        active = torch.arange(batch_size, device=sample_tensor.device) # Rows still fed to the model
+        init = int(prefix_lens.min()) if offsets is None else int((prefix_lens + offsets).max())
         with torch.no_grad():
-            if data is None: # Generate SMILES according to the pre-trained Generator
-                init = 1
-            else: # Generate sub-SMILES according to the rollout function
-                sample_tensor[:len(data)] = data # [max_len, batch_size]
-                init = len(data)
-
-            for i in range(init, self.max_len):
-                tensor = sample_tensor[:i] # Assign the initial sub-SMILES to tensor
-                logits = self.model.forward(tensor)[-1] # The final token as the result
-                probabilities = torch.nn.functional.softmax(logits, dim=1).squeeze()
-                sampled_char = torch.multinomial(probabilities, 1) # [batch_size, 1]   
-               
-                for idx in range(self.batch_size):
-                    if finished[idx]:
-                        sampled_char[idx, 0] = self.tokenizer.char_to_int[self.tokenizer.end]
-                    if sampled_char[idx, 0] == self.tokenizer.char_to_int[self.tokenizer.end]:
-                        finished[idx] = True
-
-                sample_tensor[i] = sampled_char.squeeze()
-                if all(finished):
+            if self.use_cache and cache is None:
+                cache = KVCache(len(self.model.encoder.layers), self.max_len, batch_size, self.model.d_model, sample_tensor.device)
+
+            for i in range(init, len(sample_tensor)):
+                if self.use_cache: # The first step feeds the whole sub-SMILES, later steps only the last sampled token
+                    row_offsets = None if offsets is None else offsets[active]
+                    logits = self._incremental(sample_tensor[cache.length:i, active], cache, row_offsets)[-1]
+                else:
+                    tensor = sample_tensor[:i, active] # Assign the initial sub-SMILES to tensor
+                    logits = self.model.forward(tensor)[-1] # The final token as the result
+                probabilities = torch.nn.functional.softmax(logits, dim=1)
+                sampled_char = torch.multinomial(probabilities, 1).squeeze(1) # [len(active)]
+                # Finished sequences keep emitting the end token (only reachable without compaction)
+                sampled_char = sampled_char.masked_fill(finished[active], end_token)
+                if offsets is None: # Rows with a longer prefix keep their own token at this position
+                    forced = prefix_lens[active] > i
+                    sampled_char = torch.where(forced, sample_tensor[i, active], sampled_char)
+                    done = (sampled_char == end_token) & ~forced
+                else: # Left-padded rows also stop after max_len tokens of their own
+                    done = (sampled_char == end_token) | (i + 1 >= self.max_len + offsets[active])
+
+                sample_tensor[i] = end_token # Rows dropped by compaction are already finished
+                sample_tensor[i, active] = sampled_char
+                finished[active] = finished[active] | done
+                if finished.all():
                     break
+                if self.compact:
+                    keep = ~finished[active]
+                    # Wait until a quarter of the rows are done, so the cache is copied only a few times
+                    if keep.sum() <= 0.75 * len(active):
+                        active = active[keep]
+                        if self.use_cache:
+                            cache.select(keep)
 
-        smiles = ["".join(self.tokenizer.decode(sample_tensor[:, i].squeeze().detach().cpu().numpy())).strip("^$ ") for i in range(self.batch_size)]
+        if offsets is not None: # Undo the left padding
+            rows = torch.arange(batch_size, device=sample_tensor.device)
+            sample_tensor = sample_tensor[offsets[None, :] + torch.arange(self.max_len, device=sample_tensor.device)[:, None], rows[None, :]]
+        smiles = [smi.strip("^$ ") for smi in self.tokenizer.decode_many(sample_tensor.t().cpu().numpy())]
         self.model.train()
         return smiles
 
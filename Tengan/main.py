@@ -20,6 +20,7 @@ from .rollout import Rollout, OwnModel
 from .discriminator import DiscriminatorModel
 from .generator import GeneratorModel, GenSampler
 from .data_iter import GenDataLoader, DisDataLoader
+from .descriptors import descriptor_engine, RewardCache
 rdBase.DisableLog('rdApp.error')
 warnings.filterwarnings("ignore")
 
@@ -41,6 +42,7 @@ parser.add_argument(
 
 parser.add_argument('--generated_num', type=int, default=10000, help='generate size of the negative file: 5000 for QM9, 10000 for ZINC')
 parser.add_argument('--gen_train_size', type=int, default=9600, help='the size of training data: 4800 for QM9, 9600 for ZINC')
+parser.add_argument('--token_cache', type=str, default=None, help='the directory written by Tengan.build_token_cache; if None, the dataset is tokenized on the fly')
 parser.add_argument('--gen_num_encoder_layers', type=int, default=4, help='the number of transformer encoder layers')
 parser.add_argument('--gen_d_model', type=int, default=128, help='the dimension of the embedding')
 parser.add_argument('--gen_dim_feedforward', type=int, default=1024, help='the dimension of the feedforward layer')
@@ -71,6 +73,8 @@ parser.add_argument('--adv_lr', type=float, default=8e-5, help='the learning rat
 parser.add_argument('--save_name', type=int, default=66, help='the name of the loaded model')
 parser.add_argument('--roll_num', type=int, default=8, help='the rollout times for Monte Carlo tree search: 16 for QM9, 8 for ZINC')
 parser.add_argument('--adv_epochs', type=int, default=100, help='the adverarial training epochs for TenGAN or Ten(W)GAN')
+parser.add_argument('--roll_rows', type=int, default=512, help='the maximum number of rollout sequences decoded and discriminated together')
+parser.add_argument('--reward_cache_size', type=int, default=200000, help='the maximum number of memoized property scores shared by all rollouts')
 args = parser.parse_known_args()[0]
 
 # ===========================
@@ -101,105 +105,115 @@ else:
 
 # File paths
 PATHS = 'res/save_models/' + args.dataset_name + '/' + MODEL_NAME + '/rollout_' + str(args.roll_num) + '/' + '/batch_' + str(args.batch_size) + '/' + args.properties
-if not os.path.exists(PATHS):
-    os.makedirs(PATHS)
 
 # Save the pre-trained generator and discriminator
 G_PRETRAINED_MODEL = PATHS + '/g_pretrained.pkl' 
 D_PRETRAINED_MODEL = PATHS + '/d_pretrained.pkl'
 PROPERTY_FILE = PATHS + '/trained_results.csv'
 
-# Save adversarial training information
-if args.adversarial_train:
-    with open(PROPERTY_FILE, 'a+') as wf:
-        wf.truncate(0)
-        wf.write('{},{},{},{},{},{},{},{},{},{}\n'.format('Epoch', 'Mean', 'Std', 'Min', 'Max', 'Validity', 'Uniqueness', 'Novelty', 'Diversity', 'Time'))
 TenGAN_G_MODEL = PATHS + '/Epoch_' + str(args.save_name) + '_gen.pkl'
 TenGAN_D_MODEL = PATHS + '/Epoch_' + str(args.save_name) + '_dis.pkl'
 
 args = parser.parse_args()
 
 # ===========================
-print('\n\n\nVocabulary Information:')
-print('==================================================================') 
 tokenizer = Tokenizer()
 tokenizer.build_vocab()
-print(tokenizer.char_to_int)
-
-# Save all hyperparameters
-with open(PATHS+'/hyperparameters.csv', 'a+') as hp:
-    # Clean the hyperparameters file
-    hp.truncate(0)
-
-    params = {}
-    print('\n\nParameter Information:')
-    print('==================================================================')
-    params['POSITIVE_FILE'] = POSITIVE_FILE
-    params['NEGATIVE_FILE'] = NEGATIVE_FILE
-    params['G_PRETRAINED_MODEL'] = G_PRETRAINED_MODEL
-    params['D_PRETRAINED_MODEL'] = D_PRETRAINED_MODEL
-    params['PROPERTY_FILE'] = PROPERTY_FILE
-    params['BATCH_SIZE'] = args.batch_size
-    params['MAX_LEN'] = args.max_len
-    params['VOCAB_SIZE'] = len(tokenizer.char_to_int)
-    params['DEVICE'] = DEVICE
-    params['GPUS'] = GPUS
-    for param in params:
-        string = param + ' ' * (25 - len(param))
-        print('{}:   {}'.format(string, params[param]))
-        hp.write('{}\t{}\n'.format(str(param), str(params[param])))
-    print('\n')
-
-    params = {}
-    params['GEN_PRETRAIN'] = args.gen_pretrain
-    params['GENERATED_NUM'] = args.generated_num
-    params['GEN_TRAIN_SIZE'] = args.gen_train_size
-    params['GEN_NUM_ENCODER_LAYERS'] = args.gen_num_encoder_layers
-    params['GEN_DIM_FEEDFORWARD'] = args.gen_dim_feedforward
-    params['GEN_D_MODEL'] = args.gen_d_model
-    params['GEN_NUM_HEADS'] = args.gen_num_heads
-    params['GEN_MAX_LR'] = args.gen_max_lr
-    params['GEN_DROPOUT'] = args.gen_dropout
-    params['GEN_EPOCHS'] = args.gen_epochs
-    for param in params:
-        string = param + ' ' * (25 - len(param))
-        print('{}:   {}'.format(string, params[param]))
-        hp.write('{}\t{}\n'.format(str(param), str(params[param])))
-    print('\n')
-
-    params = {}
-    params['DIS_PRETRAIN'] = args.dis_pretrain
-    params['DIS_WGAN'] = args.dis_wgan
-    params['DIS_MINIBATCH'] = args.dis_minibatch
-    params['DIS_NUM_ENCODER_LAYERS'] = args.dis_num_encoder_layers
-    params['DIS_D_MODEL'] = args.dis_d_model
-    params['DIS_NUM_HEADS'] = args.dis_num_heads
-    params['DIS_MAX_LR'] = DIS_MAX_LR
-    params['DIS_EPOCHS'] = args.dis_epochs
-    params['DIS_FEED_FORWARD'] = args.dis_feed_forward
-    params['DIS_DROPOUT'] = args.dis_dropout
-    for param in params:
-        string = param + ' ' * (25 - len(param))
-        print('{}:   {}'.format(string, params[param]))
-        hp.write('{}\t{}\n'.format(str(param), str(params[param])))
-    print('\n')
-
-    params = {}
-    params['ADVERSARIAL_TRAIN'] = args.adversarial_train
-    params['PROPERTIES'] = args.properties
-    params['DIS_LAMBDA'] = args.dis_lambda
-    params['MODEL_NAME'] = MODEL_NAME
-    params['UPDATE_RATE'] = args.update_rate
-    params['ADV_LR'] = args.adv_lr
-    params['G_STEP'] = G_STEP
-    params['D_STEP'] = D_STEP
-    params['ADV_EPOCHS'] = args.adv_epochs
-    params['ROLL_NUM'] = args.roll_num
-    for param in params:
-        string = param + ' ' * (25 - len(param))
-        print('{}:   {}'.format(string, params[param]))
-        hp.write('{}\t{}\n'.format(str(param), str(params[param])))
-    print('==================================================================')
+
+# ===========================
+# Output files of the run. Only called from __main__: spawned worker processes (e.g. of the descriptor
+# pool) re-import this module with the same argv and must not truncate them again
+def setup_run_files():
+    if not os.path.exists(PATHS):
+        os.makedirs(PATHS)
+
+    # Save adversarial training information
+    if args.adversarial_train:
+        with open(PROPERTY_FILE, 'a+') as wf:
+            wf.truncate(0)
+            wf.write('{},{},{},{},{},{},{},{},{},{}\n'.format('Epoch', 'Mean', 'Std', 'Min', 'Max', 'Validity', 'Uniqueness', 'Novelty', 'Diversity', 'Time'))
+
+    print('\n\n\nVocabulary Information:')
+    print('==================================================================') 
+    print(tokenizer.char_to_int)
+
+    # Save all hyperparameters
+    with open(PATHS+'/hyperparameters.csv', 'a+') as hp:
+        # Clean the hyperparameters file
+        hp.truncate(0)
+
+        params = {}
+        print('\n\nParameter Information:')
+        print('==================================================================')
+        params['POSITIVE_FILE'] = POSITIVE_FILE
+        params['NEGATIVE_FILE'] = NEGATIVE_FILE
+        params['G_PRETRAINED_MODEL'] = G_PRETRAINED_MODEL
+        params['D_PRETRAINED_MODEL'] = D_PRETRAINED_MODEL
+        params['PROPERTY_FILE'] = PROPERTY_FILE
+        params['BATCH_SIZE'] = args.batch_size
+        params['MAX_LEN'] = args.max_len
+        params['VOCAB_SIZE'] = len(tokenizer.char_to_int)
+        params['DEVICE'] = DEVICE
+        params['GPUS'] = GPUS
+        for param in params:
+            string = param + ' ' * (25 - len(param))
+            print('{}:   {}'.format(string, params[param]))
+            hp.write('{}\t{}\n'.format(str(param), str(params[param])))
+        print('\n')
+
+        params = {}
+        params['GEN_PRETRAIN'] = args.gen_pretrain
+        params['GENERATED_NUM'] = args.generated_num
+        params['GEN_TRAIN_SIZE'] = args.gen_train_size
+        params['TOKEN_CACHE'] = args.token_cache
+        params['GEN_NUM_ENCODER_LAYERS'] = args.gen_num_encoder_layers
+        params['GEN_DIM_FEEDFORWARD'] = args.gen_dim_feedforward
+        params['GEN_D_MODEL'] = args.gen_d_model
+        params['GEN_NUM_HEADS'] = args.gen_num_heads
+        params['GEN_MAX_LR'] = args.gen_max_lr
+        params['GEN_DROPOUT'] = args.gen_dropout
+        params['GEN_EPOCHS'] = args.gen_epochs
+        for param in params:
+            string = param + ' ' * (25 - len(param))
+            print('{}:   {}'.format(string, params[param]))
+            hp.write('{}\t{}\n'.format(str(param), str(params[param])))
+        print('\n')
+
+        params = {}
+        params['DIS_PRETRAIN'] = args.dis_pretrain
+        params['DIS_WGAN'] = args.dis_wgan
+        params['DIS_MINIBATCH'] = args.dis_minibatch
+        params['DIS_NUM_ENCODER_LAYERS'] = args.dis_num_encoder_layers
+        params['DIS_D_MODEL'] = args.dis_d_model
+        params['DIS_NUM_HEADS'] = args.dis_num_heads
+        params['DIS_MAX_LR'] = DIS_MAX_LR
+        params['DIS_EPOCHS'] = args.dis_epochs
+        params['DIS_FEED_FORWARD'] = args.dis_feed_forward
+        params['DIS_DROPOUT'] = args.dis_dropout
+        for param in params:
+            string = param + ' ' * (25 - len(param))
+            print('{}:   {}'.format(string, params[param]))
+            hp.write('{}\t{}\n'.format(str(param), str(params[param])))
+        print('\n')
+
+        params = {}
+        params['ADVERSARIAL_TRAIN'] = args.adversarial_train
+        params['PROPERTIES'] = args.properties
+        params['DIS_LAMBDA'] = args.dis_lambda
+        params['MODEL_NAME'] = MODEL_NAME
+        params['UPDATE_RATE'] = args.update_rate
+        params['ADV_LR'] = args.adv_lr
+        params['G_STEP'] = G_STEP
+        params['D_STEP'] = D_STEP
+        params['ADV_EPOCHS'] = args.adv_epochs
+        params['ROLL_NUM'] = args.roll_num
+        params['ROLL_ROWS'] = args.roll_rows
+        params['REWARD_CACHE_SIZE'] = args.reward_cache_size
+        for param in params:
+            string = param + ' ' * (25 - len(param))
+            print('{}:   {}'.format(string, params[param]))
+            hp.write('{}\t{}\n'.format(str(param), str(params[param])))
+        print('==================================================================')
 
 # ============================================================================
 def evaluation(generated_smiles, gen_data_loader, time=None, epoch=None):
@@ -213,12 +227,8 @@ def evaluation(generated_smiles, gen_data_loader, time=None, epoch=None):
             if mol != None and mol.GetNumAtoms() > 1 and Chem.MolToSmiles(mol) != ' ':
                 valid_smiles.append(Chem.MolToSmiles(mol))   
         unique_smiles = list(set(valid_smiles))
-        novel_smiles = []
-        # Keep the unique order for the POSITIVE dataset
-        train_smiles = [Chem.MolToSmiles(Chem.MolFromSmiles(sm)) for sm in gen_data_loader.train_data]
-        for smile in unique_smiles:
-            if smile not in train_smiles:
-                novel_smiles.append(smile)
+        # Set lookups against the canonical SMILES of the training split (indexed once in setup)
+        novel_smiles = [smile for smile in unique_smiles if smile not in gen_data_loader.train_canonical]
 
         validity = len(valid_smiles)/len(generated_mols)
         if len(valid_smiles) == 0:
@@ -246,15 +256,17 @@ def evaluation(generated_smiles, gen_data_loader, time=None, epoch=None):
             for i in range(len(novel_smiles)):
                 print(novel_smiles[i])
         print('\n')  
-        # Compute the property scores of novel smiles (DISABLED due to RDKit incompatibility)
+        # Compute the property scores of novel smiles
         if len(novel_smiles):
-            print('[{}]: Property evaluation skipped (RDKit compatibility issue)'.format(args.properties))
+            vals = descriptor_engine.compute(novel_smiles, [args.properties])[args.properties]
+            mean, std, min, max = np.mean(vals), np.std(vals), np.min(vals), np.max(vals)
+            print('[{}]: [Mean: {:.3f}   STD: {:.3f}   MIN: {:.3f}   MAX: {:.3f}]'.format(args.properties, mean, std, min, max))
 
             # Write the property scores into file
             if epoch is not None and time is not None:
                 with open(PROPERTY_FILE, 'a+') as wf:
-                    wf.write('{},{},{},{},{},{:.5f},{:.5f},{:.5f},{:.5f},{:.1f}\n'
-.format(epoch+1, 'NA', 'NA', 'NA', 'NA',
+                    wf.write('{},{:.3f},{:.3f},{:.3f},{:.3f},{:.5f},{:.5f},{:.5f},{:.5f},{:.1f}\n'
+.format(epoch+1, mean, std, min, max,
         validity, uniqueness, novelty, diversity, time))
 
         else:
@@ -291,7 +303,7 @@ def main():
     
     # ===========================
     # Generator objects definition
-    gen_data_loader = GenDataLoader(POSITIVE_FILE, args.gen_train_size, args.batch_size)
+    gen_data_loader = GenDataLoader(POSITIVE_FILE, args.gen_train_size, args.batch_size, args.token_cache)
     gen_data_loader.setup()
     gen = GeneratorModel(
         n_tokens = gen_data_loader.tokenizer.n_tokens, 
@@ -392,18 +404,18 @@ def main():
         weights_summary=None,
         progress_bar_refresh_rate=0)
     pg_optimizer = torch.optim.Adam(params = gen.parameters(), lr=args.adv_lr)
-    rollout = Rollout(gen, roll_own_model, tokenizer, args.update_rate, DEVICE)
+    reward_cache = RewardCache(maxsize=args.reward_cache_size)
+    rollout = Rollout(gen, roll_own_model, tokenizer, args.update_rate, DEVICE, reward_cache, args.roll_rows)
 
     # Adversarial training
     if args.adversarial_train:
         print("\n\nAdversarial Training...")
         for epoch in range(args.adv_epochs): 
-            rollsampler = GenSampler(rollout.own_model, gen_data_loader.tokenizer, args.batch_size, args.max_len)
+            rollsampler = GenSampler(rollout.own_model, gen_data_loader.tokenizer, args.batch_size, args.max_len, compact=True)
             for g_step in range(G_STEP):
                 # Sampling a batch of samples
                 samples = sampler.sample()
-                encoded = [torch.tensor(tokenizer.encode(s)) for s in samples] # Within the start and end token
-                encoded = torch.nn.utils.rnn.pad_sequence(encoded).squeeze().to(DEVICE) # [max_len, batch_size]
+                encoded = torch.from_numpy(tokenizer.encode_many(samples)).t().contiguous().to(DEVICE) # [max_len, batch_size] within the start and end token
                 gen_pred = gen.forward(encoded[:-1]) # [max_len, batch_size, vocab_size]
                 gen_pred = gen_pred.transpose(0, 1) # [batch_size, max_len, vocab_size]
                 gen_pred = gen_pred.contiguous().view(-1, gen_pred.size(-1)) # [batch_size * max_len, vocab_size]
@@ -419,6 +431,9 @@ def main():
                 loss.backward()
                 torch.nn.utils.clip_grad_norm_(gen.parameters(), 5, norm_type=2)
                 pg_optimizer.step() 
+            cache_stats = reward_cache.epoch_stats()
+            print('Reward cache: {} hits, {} misses ({:.2f}% hit rate), {} entries'.format(
+                cache_stats['hits'], cache_stats['misses'], cache_stats['hit_rate']*100, cache_stats['entries']))
             # Update models
             rollout.update_params()
             # Save models
@@ -452,6 +467,7 @@ def main():
 
 #============================================================================
 if __name__ == '__main__':
+    setup_run_files()
     main()
 
 
@@ -4,19 +4,20 @@ import math
 import pickle
 import random
 import numpy as np
-import pandas as pd
 from rdkit import Chem
 from rdkit import rdBase
 from math import exp, log
-from copy import deepcopy
 from rdkit.Chem import QED
+from rdkit.Chem import FilterCatalog
 from rdkit import DataStructs
-from rdkit.Chem import PandasTools, Crippen, Descriptors
-from rdkit.Chem.rdMolDescriptors import GetMorganFingerprintAsBitVect
+from rdkit.Chem import Crippen, Descriptors, rdMolDescriptors
+from .fingerprints import fingerprint_cache
 rdBase.DisableLog('rdApp.error')
 # ============================================================================
 # Build the vocabulary for SMILES. Besides, definite vectorize function (atoms -> numerics) and devectorize function (numerics -> atoms)
 class Tokenizer():
+    # Single-char proxies of the multi-char symbols: Cl -> Q, Br -> W, H2 -> Z, H3 -> X
+    proxies = {'Q': 'Cl', 'W': 'Br', 'Z': 'H2', 'X': 'H3'}
 
     def __init__(self):
         self.start = "^"
@@ -52,27 +53,62 @@ class Tokenizer():
         # create the dictionaries      
         self.char_to_int = {c:i for i,c in enumerate(self._tokenlist)}
         self.int_to_char = {i:c for c,i in self.char_to_int.items()}
+        # Translation tables: latin-1 byte of a char -> token id (255 if unknown), token id -> decoded string
+        if len(self._tokenlist) >= 255 or any(len(c) != 1 or ord(c) > 255 for c in self._tokenlist):
+            raise ValueError('Tokens must be single latin-1 chars and fewer than 255')
+        table = bytearray([255]) * 256
+        for c, i in self.char_to_int.items():
+            table[ord(c)] = i
+        self._encode_table = bytes(table)
+        self._decode_table = {i: self.proxies.get(c, c) for i, c in self.int_to_char.items()}
+
+    def _token_bytes(self, smi):
+        smi = smi.replace('Cl', 'Q').replace('Br', 'W').replace('H2', 'Z').replace('H3', 'X')
+        try:
+            codes = smi.encode('latin-1').translate(self._encode_table)
+        except UnicodeEncodeError:
+            codes = b'\xff'
+        if b'\xff' in codes:
+            raise KeyError([c for c in smi if c not in self.char_to_int][0])
+        return codes
     
     def encode(self, smi):
-        encoded = []
-        smi = smi.replace('Cl', 'Q')
-        smi = smi.replace('Br', 'W')
-        # hydrogens
-        smi = smi.replace('H2', 'Z')
-        smi = smi.replace('H3', 'X')
-
-        return [self.char_to_int[self.start]] + [self.char_to_int[s] for s in smi] + [self.char_to_int[self.end]]
+        return [self.char_to_int[self.start]] + list(self._token_bytes(smi)) + [self.char_to_int[self.end]]
     
     def decode(self, ords):
-        smi = ''.join([self.int_to_char[o] for o in ords]) 
-        # hydrogens
-        smi = smi.replace('Z', 'H2')
-        smi = smi.replace('X', 'H3')
-        # replace proxy atoms for double char atoms symbols
-        smi = smi.replace('Q', 'Cl')
-        smi = smi.replace('W', 'Br')
-        
-        return smi
+        return self.decode_many([ords])[0]
+
+    def encode_many(self, smiles, special=True):
+        """
+            smiles: a list of SMILES
+            special: add the start and end tokens (False is the same as encode(smi)[1:-1])
+            return: token ids padded with 0 (pad) with the shape [len(smiles), maxlength]
+        """
+        codes = [self._token_bytes(smi) for smi in smiles]
+        lengths = np.array([len(c) for c in codes], dtype=np.int64)
+        shift = 1 if special else 0
+        encoded = np.zeros((len(codes), (lengths.max() if len(codes) else 0) + 2 * shift), dtype=np.int64)
+        flat = np.frombuffer(b''.join(codes), dtype=np.uint8)
+        rows = np.repeat(np.arange(len(codes)), lengths)
+        cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + shift
+        encoded[rows, cols] = flat
+        if special:
+            encoded[:, 0] = self.char_to_int[self.start]
+            encoded[np.arange(len(codes)), lengths + 1] = self.char_to_int[self.end]
+        return encoded
+
+    def decode_many(self, ords):
+        """
+            ords: token ids with the shape [n, length] (or a list of sequences)
+            return: n decoded strings (start, end and pad chars are kept)
+        """
+        if not (isinstance(ords, np.ndarray) and ords.ndim == 2): # Sequences of different lengths
+            return [self.decode_many(np.asarray(row).reshape(1, -1))[0] for row in ords]
+        if ords.size and (ords.min() < 0 or ords.max() >= len(self._tokenlist)):
+            raise KeyError(int(ords.max() if ords.max() >= len(self._tokenlist) else ords.min()))
+        chars = ords.astype(np.uint8).tobytes().decode('latin-1')
+        width = ords.shape[1]
+        return [chars[i * width:(i + 1) * width].translate(self._decode_table) for i in range(len(ords))]
 
     @property
     def n_tokens(self):
@@ -93,9 +129,8 @@ def reward_fn(properties, generated_smiles):
 # Diversity
 def batch_diversity(smiles):
     scores = []
-    df = pd.DataFrame({'smiles': smiles})
-    PandasTools.AddMoleculeColumnToFrame(df, 'smiles', 'mol')
-    fps = [GetMorganFingerprintAsBitVect(m, 4, nBits=2048) for m in df['mol'] if m is not None]
+    fps = [fingerprint_cache.morgan(sm, 4, 2048) for sm in smiles]
+    fps = [fp for fp in fps if fp is not None]
     for i in range(1, len(fps)):
         scores.extend(DataStructs.BulkTanimotoSimilarity(fps[i], fps[:i], returnDistance=True))
     return np.mean(scores)
@@ -238,6 +273,10 @@ StructuralAlertSmarts = [
 StructuralAlerts = []
 for smarts in StructuralAlertSmarts:
     StructuralAlerts.append(Chem.MolFromSmarts(smarts))
+# All alerts are matched in one C++ pass; each entry stops at its first hit
+StructuralAlertCatalog = FilterCatalog.FilterCatalog()
+for i, smarts in enumerate(StructuralAlertSmarts):
+    StructuralAlertCatalog.AddEntry(FilterCatalog.FilterCatalogEntry(str(i), FilterCatalog.SmartsMatcher(str(i), smarts, 1)))
 pads1 = [[2.817065973, 392.5754953, 290.7489764, 2.419764353, 49.22325677, 65.37051707, 104.9805561],
          [0.486849448, 186.2293718, 2.066177165, 3.902720615, 1.027025453, 0.913012565, 145.4314800],
          [2.948620388, 160.4605972, 3.615294657, 4.435986202, 0.290141953, 1.300669958, 148.7763046],
@@ -271,24 +310,23 @@ def qed_eval(w, p, gerebtzoff):
         t += w[i] * log(d[i])
     return (exp(t / sum(w)))
 
-def qed(mol):
-    matches = []
+def qed_properties(mol):
+    """[MW, ALOGP, HBA, HBD, PSA, ROTB, AROM, ALERTS, Ro5 failures]; the first 8 equal rdkit.Chem.QED.properties."""
     if mol is None:
-        raise WrongArgument("properties(mol)", "mol argument is \'None\'")
+        raise ValueError("qed_properties(mol): mol argument is 'None'")
     x = [0] * 9
     x[0] = Descriptors.MolWt(mol)
     x[1] = Descriptors.MolLogP(mol)
+    # Each acceptor pattern is matched once
     for hba in Acceptors:
-        if mol.HasSubstructMatch(hba):
-            matches = mol.GetSubstructMatches(hba)
-            x[2] += len(matches)
+        x[2] += len(mol.GetSubstructMatches(hba))
     x[3] = Descriptors.NumHDonors(mol)          
     x[4] = Descriptors.TPSA(mol)
     x[5] = Descriptors.NumRotatableBonds(mol)
-    x[6] = Chem.GetSSSR(Chem.DeleteSubstructs(deepcopy(mol), AliphaticRings))
-    for alert in StructuralAlerts:
-        if (mol.HasSubstructMatch(alert)):
-            x[7] += 1
+    # DeleteSubstructs already returns a new molecule; newer RDKit returns the SSSR rings rather than their count
+    sssr = Chem.GetSSSR(Chem.DeleteSubstructs(mol, AliphaticRings))
+    x[6] = sssr if isinstance(sssr, int) else len(sssr)
+    x[7] = len(StructuralAlertCatalog.GetMatches(mol))
     ro5_failed = 0
     if x[3] > 5:
         ro5_failed += 1
@@ -299,33 +337,39 @@ def qed(mol):
     if x[1] > 5:
         ro5_failed += 1
     x[8] = ro5_failed
-    return qed_eval([0.66, 0.46, 0.05, 0.61, 0.06, 0.65, 0.48, 0.95], x, True)
+    return x
+
+def qed(mol, gerebtzoff=True):
+    # gerebtzoff=False uses the same desirability functions as rdkit.Chem.QED.qed
+    return qed_eval([0.66, 0.46, 0.05, 0.61, 0.06, 0.65, 0.48, 0.95], qed_properties(mol), gerebtzoff)
+
+def druglikeness(mol):
+    if mol is None:
+        return 0.0
+    return qed(mol)
 
 def batch_druglikeness(smiles):
     vals = []
     for sm in smiles:
         mol = Chem.MolFromSmiles(sm)
-        if mol is None:
-            vals.append(0.0)
-        else:
-            val = qed(mol)
-            vals.append(val)
+        vals.append(druglikeness(mol))
     return vals
 
 # Solubility
+def solubility(mol):
+    if mol is None:
+        return 0.0
+    low_logp = -2.12178879609
+    high_logp = 6.0429063424
+    logp = Crippen.MolLogP(mol)
+    val = (logp - low_logp) / (high_logp - low_logp)
+    return np.clip(val, 0.1, 1.0)
+
 def batch_solubility(smiles):
     vals = []
     for sm in smiles: 
         mol = Chem.MolFromSmiles(sm)
-        if mol is None:
-            vals.append(0.0)
-        else:
-            low_logp = -2.12178879609
-            high_logp = 6.0429063424
-            logp = Crippen.MolLogP(mol)
-            val = (logp - low_logp) / (high_logp - low_logp)
-            val = np.clip(val, 0.1, 1.0)
-            vals.append(val)
+        vals.append(solubility(mol))
     return vals
 
 # Read synthesizability model
@@ -343,56 +387,62 @@ def readSAModel(filename=None):
 SA_model = readSAModel()
 
 #synthesizability
+def synthesizability(mol, fp=None):
+    """Normalized SA score of a Mol; `fp` is its radius-2 Morgan count fingerprint if already computed."""
+    if mol is None or mol.GetNumAtoms() <= 1:
+        return 0.0
+    # fragment score
+    if fp is None:
+        fp = fingerprint_cache.generator(2, 2048).GetSparseCountFingerprint(mol)
+    fps = fp.GetNonzeroElements()
+    score1 = 0.
+    nf = 0
+    for bitId, v in fps.items():
+        nf += v
+        sfp = bitId
+        score1 += SA_model.get(sfp, -4) * v
+    score1 /= nf
+    # features score
+    nAtoms = mol.GetNumAtoms()
+    nChiralCenters = len(Chem.FindMolChiralCenters(mol, includeUnassigned=True))
+    ri = mol.GetRingInfo()
+    nSpiro = rdMolDescriptors.CalcNumSpiroAtoms(mol)
+    nBridgeheads = rdMolDescriptors.CalcNumBridgeheadAtoms(mol)
+    nMacrocycles = 0
+    for x in ri.AtomRings():
+        if len(x) > 8:
+            nMacrocycles += 1
+    sizePenalty = nAtoms**1.005 - nAtoms
+    stereoPenalty = math.log10(nChiralCenters + 1)
+    spiroPenalty = math.log10(nSpiro + 1)
+    bridgePenalty = math.log10(nBridgeheads + 1)
+    macrocyclePenalty = 0.
+    if nMacrocycles > 0:
+        macrocyclePenalty = math.log10(2)
+    score2 = 0. - sizePenalty - stereoPenalty - spiroPenalty - bridgePenalty - macrocyclePenalty
+    score3 = 0.
+    if nAtoms > len(fps):
+        score3 = math.log(float(nAtoms) / len(fps)) * .5
+    sascore = score1 + score2 + score3
+    min = -4.0
+    max = 2.5
+    sascore = 11. - (sascore - min + 1) / (max - min) * 9.
+    # smooth the 10-end
+    if sascore > 8.:
+        sascore = 8. + math.log(sascore + 1. - 9.)
+    if sascore > 10.:
+        sascore = 10.0
+    elif sascore < 1.:
+        sascore = 1.0
+    val = (sascore - 5) / (1.5 - 5)
+    return np.clip(val, 0.1, 1.0)
+
 def batch_SA(smiles):
     vals = []
     for sm in smiles:
-        mol = Chem.MolFromSmiles(sm)
+        mol = fingerprint_cache.mol(sm)
         if sm != '' and mol is not None and mol.GetNumAtoms() > 1:
-            # fragment score
-            fp = Chem.AllChem.GetMorganFingerprint(mol, 2)
-            fps = fp.GetNonzeroElements()
-            score1 = 0.
-            nf = 0
-            for bitId, v in fps.items():
-                nf += v
-                sfp = bitId
-                score1 += SA_model.get(sfp, -4) * v
-            score1 /= nf
-            # features score
-            nAtoms = mol.GetNumAtoms()
-            nChiralCenters = len(Chem.FindMolChiralCenters(mol, includeUnassigned=True))
-            ri = mol.GetRingInfo()
-            nSpiro = Chem.AllChem.CalcNumSpiroAtoms(mol)
-            nBridgeheads = Chem.AllChem.CalcNumBridgeheadAtoms(mol)
-            nMacrocycles = 0
-            for x in ri.AtomRings():
-                if len(x) > 8:
-                    nMacrocycles += 1
-            sizePenalty = nAtoms**1.005 - nAtoms
-            stereoPenalty = math.log10(nChiralCenters + 1)
-            spiroPenalty = math.log10(nSpiro + 1)
-            bridgePenalty = math.log10(nBridgeheads + 1)
-            macrocyclePenalty = 0.
-            if nMacrocycles > 0:
-                macrocyclePenalty = math.log10(2)
-            score2 = 0. - sizePenalty - stereoPenalty - spiroPenalty - bridgePenalty - macrocyclePenalty
-            score3 = 0.
-            if nAtoms > len(fps):
-                score3 = math.log(float(nAtoms) / len(fps)) * .5
-            sascore = score1 + score2 + score3
-            min = -4.0
-            max = 2.5
-            sascore = 11. - (sascore - min + 1) / (max - min) * 9.
-            # smooth the 10-end
-            if sascore > 8.:
-                sascore = 8. + math.log(sascore + 1. - 9.)
-            if sascore > 10.:
-                sascore = 10.0
-            elif sascore < 1.:
-                sascore = 1.0
-            val = (sascore - 5) / (1.5 - 5)
-            val = np.clip(val, 0.1, 1.0)
-            vals.append(val)
+            vals.append(synthesizability(mol, fingerprint_cache.morgan_counts(sm, 2)))
         else:
             vals.append(0.0)
     return vals
\ No newline at end of file
@@ -0,0 +1,58 @@
+import os
+import hashlib
+from rdkit import Chem
+from rdkit import rdBase
+rdBase.DisableLog('rdApp.error')
+# ============================================================================
+# Canonical-SMILES index of a training dataset for novelty checks.
+# Built once and persisted next to the dataset ("dataset/ZINC.csv" -> "dataset/ZINC.canonical.tsv"),
+# rebuilt automatically when the dataset file changes.
+def canonical_smiles(smiles):
+    mol = Chem.MolFromSmiles(smiles) if smiles else None
+    return Chem.MolToSmiles(mol) if mol is not None else None
+
+def index_path(dataset_file):
+    return os.path.splitext(dataset_file)[0] + '.canonical.tsv'
+
+class NoveltyIndex():
+
+    def __init__(self, canonical_by_smiles):
+        self.canonical_by_smiles = canonical_by_smiles # Dataset SMILES -> canonical SMILES (None if invalid)
+        self.canonical = set(c for c in canonical_by_smiles.values() if c is not None)
+
+    def __len__(self):
+        return len(self.canonical)
+
+    def __contains__(self, canonical):
+        return canonical in self.canonical
+
+    def subset(self, smiles):
+        """Canonical SMILES of some dataset SMILES (e.g. the training split) as a set."""
+        lookup = self.canonical_by_smiles
+        return set(lookup[sm] if sm in lookup else canonical_smiles(sm) for sm in smiles) - {None}
+
+    def novel(self, smiles):
+        """The SMILES of a list whose molecule is not in the index (invalid SMILES are skipped)."""
+        canonical = (canonical_smiles(sm) for sm in smiles)
+        return [sm for sm, c in zip(smiles, canonical) if c is not None and c not in self.canonical]
+
+    @classmethod
+    def for_dataset(cls, dataset_file):
+        """Load the persisted index of a dataset (one SMILES per line), building it if missing or stale."""
+        with open(dataset_file, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        path = index_path(dataset_file)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                lines = f.read().split('\n')
+            if lines[0] == '# sha256 ' + digest:
+                pairs = (line.split('\t') for line in lines[1:] if line)
+                return cls({sm: canonical or None for sm, canonical in pairs})
+
+        smiles = [line.strip() for line in content.decode().split('\n') if line.strip()]
+        index = cls({sm: canonical_smiles(sm) for sm in smiles})
+        with open(path, 'w') as f:
+            f.write('# sha256 ' + digest + '\n')
+            f.writelines('{}\t{}\n'.format(sm, canonical or '') for sm, canonical in index.canonical_by_smiles.items())
+        return index
@@ -2,6 +2,7 @@ import torch
 import numpy as np
 from .mol_metrics import *
 from .generator import PositionalEncoding
+from .descriptors import RewardCache
 from pytorch_lightning import LightningModule
 
 
@@ -55,12 +56,44 @@ class OwnModel(LightningModule):
 # Rollout object
 class Rollout(object):
     
-    def __init__(self, gen, roll_model, tokenizer, update_rate, device):
+    def __init__(self, gen, roll_model, tokenizer, update_rate, device, reward_cache=None, max_rows=512):
         self.ori_model = gen # Shallow copy: if mdoel's parameters change, ori_model will change
         self.own_model = roll_model
         self.tokenizer = tokenizer
         self.update_rate = update_rate
         self.device = device
+        self.reward_cache = reward_cache or RewardCache() # Property scores memoized across rollouts
+        self.max_rows = max_rows # Upper bound on the sequences decoded together in one rollout pass
+
+    def discriminate(self, smiles, dis, group_size):
+        # Probability of the real class, each block of group_size SMILES scored as its own batch
+        paded = torch.from_numpy(self.tokenizer.encode_many(smiles, special=False)).to(self.device) # [len(smiles), max_len] without the start and end tokens
+        with torch.no_grad():
+            pred = dis.forward(paded, group_size=group_size) # [len(smiles), 2]
+        pred = torch.nn.functional.softmax(pred, dim=1)
+        return pred[:, 1].cpu().numpy()
+
+    def sample_rollouts(self, paded, rollsampler, rollout_num, dis, init):
+        """
+            Monte Carlo completions of every prefix length of every rollout, stacked into passes of
+            at most max_rows sequences that are decoded together and scored by one discriminator call.
+            return: generated[i][given_num - init] (batch_size SMILES) and preds with the same layout
+        """
+        seq_len, batch_size = paded.size()
+        groups = [(i, given_num) for given_num in range(init, seq_len) for i in range(rollout_num)] # Similar prefix lengths share a pass
+        generated = [[] for _ in range(rollout_num)]
+        preds = [[] for _ in range(rollout_num)]
+        step = max(1, self.max_rows // batch_size) # Whole batches per pass
+        for start in range(0, len(groups), step):
+            chunk = groups[start:start + step]
+            prefix_lens = torch.tensor([given_num for _, given_num in chunk]).repeat_interleave(batch_size)
+            columns = torch.arange(batch_size).repeat(len(chunk))
+            smiles = rollsampler.sample_prefixes(paded, prefix_lens, columns)
+            pred = self.discriminate(smiles, dis, batch_size)
+            for j, (i, _) in enumerate(chunk):
+                generated[i].append(smiles[j * batch_size:(j + 1) * batch_size])
+                preds[i].append(pred[j * batch_size:(j + 1) * batch_size])
+        return generated, preds
 
     def get_reward(self, samples, rollsampler, rollout_num, dis, dis_lambda = 0.5, properties = None):
         """
@@ -69,28 +102,24 @@ class Rollout(object):
             - dis: discrimanator model 
             - dis_lambda: if 0: Naive RL, elif 1: SeqGAN
         """
-        encoded = [torch.tensor(self.tokenizer.encode(s)) for s in samples] # Within the start and end token
-        paded = torch.nn.utils.rnn.pad_sequence(encoded).squeeze().to(self.device) # [max_len, batch_size]
+        paded = torch.from_numpy(self.tokenizer.encode_many(samples)).t().contiguous().to(self.device) # [max_len, batch_size] within the start and end token
         seq_len, batch_size = paded.size()
         dis.to(self.device)
         # Inactivate the dropout layer
         dis.eval()
         rewards = [] # Save rewards of the generated SMILES
         init = 2 # Start from the second letter (after the start token and the first action)
+        # Generate SMILES based on every sub-SMILES of every rollout at once
+        all_generated, all_preds = self.sample_rollouts(paded, rollsampler, rollout_num, dis, init)
+        # The last token does not depend on the rollout
+        last_pred = self.discriminate(samples, dis, batch_size)
 
         for i in range(rollout_num):
             already = [] # Delete the traversed SMILES
-            # Generate SMILES based on the given sub-SMILES
             for given_num in range(init, seq_len):
-                data = paded[0:given_num] # [given_num, batch_size]
-                generated_smiles = rollsampler.sample(data) # Len of smiles: batch_size
-                generated_encoded = [torch.tensor(self.tokenizer.encode(s))[1:-1] for s in generated_smiles] # Remove the start token and end token and as the input of dis
-                generated_paded = torch.nn.utils.rnn.pad_sequence(generated_encoded).squeeze().transpose(0, 1).to(self.device) # [batch_size, max_len]
-                gind = np.array(range(generated_paded.size(0))) # batch_size
-                pred = dis.forward(generated_paded) # [batch_size, 2]
-                pred = torch.nn.functional.softmax(pred, dim=1) # [batch_size, 2]
-                # Probability of real class
-                pred = pred.data[:, 1].cpu().numpy() 
+                generated_smiles = list(all_generated[i][given_num - init]) # Len of smiles: batch_size
+                gind = np.array(range(len(generated_smiles))) # batch_size
+                pred = all_preds[i][given_num - init].copy()
                 if dis_lambda != 1.:
                     pred = dis_lambda * pred
                     # Delete sequences that are already finished, and add their rewards
@@ -102,7 +131,7 @@ class Rollout(object):
                     if len(generated_smiles): # batch_size
                         pct_unique = len(list(set(generated_smiles))) / float(len(generated_smiles))
                         weights = np.array([pct_unique / float(generated_smiles.count(sm)) for sm in generated_smiles])
-                        vals = reward_fn(properties, generated_smiles)
+                        vals = self.reward_cache.score(properties, generated_smiles)
                         rew = vals * weights
                     # Add the just calculated rewards
                     for k, r in zip(gind, rew):
@@ -117,16 +146,12 @@ class Rollout(object):
                 else:
                     rewards[given_num - init] += pred
             # For the last token 
-            last_encoded = [torch.tensor(self.tokenizer.encode(s))[1:-1] for s in samples]
-            last_paded = torch.nn.utils.rnn.pad_sequence(last_encoded).squeeze().to(self.device)
-            pred = dis.forward(last_paded.transpose(0, 1)) # [batch_size, max_len] -> [batch_size, 2]
-            pred = torch.nn.functional.softmax(pred, dim=1).cpu()
-            pred = pred.data[:, 1].numpy()
+            pred = last_pred.copy()
             if dis_lambda != 1.:
                 pred = dis_lambda * pred
                 pct_unique = len(list(set(samples))) / float(len(samples))
                 weights = np.array([pct_unique / float(samples.count(s)) for s in samples])                
-                vals = reward_fn(properties, samples)
+                vals = self.reward_cache.score(properties, samples)
                 rew = vals * weights
                 pred += (1 - dis_lambda) * rew
             if i == 0:
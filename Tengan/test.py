@@ -1,6 +1,10 @@
 import csv
 from rdkit import Chem
 from rdkit.Chem import AllChem
+try:
+    from .novelty import NoveltyIndex
+except ImportError:
+    from novelty import NoveltyIndex
 
 # ==============================
 # FILE PATHS (change if needed)
@@ -10,10 +14,9 @@ TRAIN_FILE = "dataset/ZINC.csv"
 TEST_REPORT = "res/test_report.csv"
 
 # ==============================
-# Load training data
+# Load training data (canonical SMILES index, persisted next to TRAIN_FILE)
 # ==============================
-with open(TRAIN_FILE, "r") as f:
-    train_smiles = set(line.strip() for line in f if line.strip())
+train_index = NoveltyIndex.for_dataset(TRAIN_FILE)
 
 # ==============================
 # Load generated data (TEST SET)
@@ -36,7 +39,7 @@ for smi in generated_smiles:
     mol = Chem.MolFromSmiles(smi)
 
     is_valid = mol is not None and mol.GetNumAtoms() > 1
-    is_novel = smi not in train_smiles
+    is_novel = (Chem.MolToSmiles(mol) if mol is not None else smi) not in train_index
 
     if is_valid:
         valid_count += 1
@@ -4,6 +4,7 @@ matplotlib.use('Agg')
 import seaborn as sns
 from rdkit import Chem
 from .mol_metrics import *
+from .novelty import NoveltyIndex
 import matplotlib.pyplot as plt
 
 
@@ -58,6 +59,7 @@ def distribution(real_file, gan_file, wgan_file):
 	# Read trian Dataset
 	real_lines = open(real_file, 'r').read()
 	real_lines = list(real_lines.split('\n'))  
+	real_index = NoveltyIndex.for_dataset(real_file)
 	# Read STGAN results
 	gan_lines = open(gan_file, 'r').read()
 	gan_lines = list(gan_lines.split('\n')) 
@@ -71,9 +73,7 @@ def distribution(real_file, gan_file, wgan_file):
 		mol = Chem.MolFromSmiles(s)
 		if mol and s != '':
 			gan_valid.append(s)
-	for s in list(set(gan_valid)):
-		if s not in real_lines:
-			gan_novelty.append(s)
+	gan_novelty = real_index.novel(list(set(gan_valid)))
 	gan_lines = gan_novelty
     
 	# Read the novel SMILES of ST(W)GAN
@@ -82,9 +82,7 @@ def distribution(real_file, gan_file, wgan_file):
 		mol = Chem.MolFromSmiles(s)
 		if mol and s != '':
 			wgan_valid.append(s)
-	for s in list(set(wgan_valid)):
-		if s not in real_lines:
-			wgan_novelty.append(s)
+	wgan_novelty = real_index.novel(list(set(wgan_valid)))
 	wgan_lines = wgan_novelty   
 
 	# Compute property scores for real dataset, STGAN and ST(W)GAN
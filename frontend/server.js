@@ -20,6 +20,15 @@ app.use('/api', createProxyMiddleware({
   },
 }));
 
+// Job status polling lives under /checks on the backend
+app.use('/checks', createProxyMiddleware({
+  target: backendUrl,
+  changeOrigin: true,
+  pathRewrite: {
+    '^/checks': '/checks',
+  },
+}));
+
 // Serve static files from the dist directory
 app.use(express.static(path.join(__dirname, 'dist')));
 
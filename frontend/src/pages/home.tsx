@@ -4,6 +4,50 @@ import Loading from "./loading";
 import ResultPage from "./ResultPage";
 import { getApiUrl } from "../config/api";
 
+const JOB_COMPLETED = "Molecules Generation Completed";
+const JOB_FAILED = "Molecules Generation Failed";
+const POLL_INTERVAL_MS = 3000;
+
+async function postJson(endpoint: string, body: unknown): Promise<any> {
+  const res = await fetch(getApiUrl(endpoint), {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(body),
+  });
+  const text = await res.text();
+  let json: any;
+  try {
+    json = JSON.parse(text);
+  } catch {
+    throw new Error("Backend returned invalid JSON: " + (text ? text.slice(0, 500) : "(empty response)"));
+  }
+  if (!res.ok) {
+    throw new Error((json && (json.message || json.detail || JSON.stringify(json))) || text);
+  }
+  return json;
+}
+
+async function waitForResults(jobId: string): Promise<any[]> {
+  for (;;) {
+    const job = await postJson("/checks/status_checks", { job_id: jobId });
+    if (job.message === JOB_FAILED) {
+      throw new Error(job.error || "Drug discovery job failed");
+    }
+    if (job.message === JOB_COMPLETED) {
+      break;
+    }
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+
+  const json = await postJson("/api/get_discorvery_results", { job_id: jobId });
+  if (!Array.isArray(json.results)) {
+    throw new Error("Unexpected response format: 'results' missing or not an array");
+  }
+  return json.results;
+}
+
 export default function Home() {
   const [prompt, setPrompt] = useState("");
   const [isGenerating, setIsGenerating] = useState(false);
@@ -21,41 +65,18 @@ export default function Home() {
     setResults(null);
 
     try {
-      const apiUrl = getApiUrl("/api/drug_discovery");
-      console.log("Making API request to:", apiUrl);
-      
-      const res = await fetch(apiUrl, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          text: `(query(${prompt}))`,
-        }),
+      const json = await postJson("/api/drug_discovery", {
+        text: `(query(${prompt}))`,
       });
 
-      const text = await res.text();
-
-      let json: any;
-      try {
-        json = JSON.parse(text);
-      } catch {
-        console.error("Non-JSON response from backend:", text);
-        // Include server text in error so it's easier to debug
-        throw new Error("Backend returned invalid JSON: " + (text ? text.slice(0, 500) : "(empty response)"));
-      }
-
-      if (!res.ok) {
-        // If server returned structured JSON error include that message
-        const errMsg = (json && (json.message || json.detail || JSON.stringify(json))) || text;
-        throw new Error(errMsg);
-      }
-
-      if (!Array.isArray(json.results)) {
-        throw new Error("Unexpected response format: 'results' missing or not an array");
+      // The backend queues the pipeline as a job: poll its status, then fetch the results
+      if (!json.job_id) {
+        throw new Error("Unexpected response format: 'job_id' missing");
       }
+      setStatus("Job submitted, waiting for results...");
+      const results = await waitForResults(json.job_id);
 
-      setResults(json.results);
+      setResults(results);
       setStatus("Generation complete.");
     } catch (e) {
       setStatus("ERROR: " + (e as Error).message);
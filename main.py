@@ -1,10 +1,21 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes.drugs import router as text_router
 from routes.checks import router as check_router
 from routes.metrics import router as metrics_router
+from utils.model_registry import registry
 
-app = FastAPI(title="Pindora Shield API",description="Drug discovery and molecule generation API",version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the generator and API clients once; requests share the warm instances
+    try:
+        registry.load()
+    except Exception as e:
+        print(f"Model preload failed, will retry on first request: {e}")
+    yield
+
+app = FastAPI(title="Pindora Shield API",description="Drug discovery and molecule generation API",version="1.0.0",lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -6,13 +6,20 @@ class TextInput(BaseModel):
     
 class TextResponse(BaseModel):
     input_text: str
+    job_id: Optional[str] = None
     results: Optional[List[Dict[str, Any]]] = None
     status: str
     message: Optional[str] = None
 
+class JobInput(BaseModel):
+    job_id: str
+
 class Generate3DInput(BaseModel):
     input_smile: str
 
+class SmilesBatchInput(BaseModel):
+    smiles: List[str]
+
 class Generate3DResponse(BaseModel):
     message: str
     file_path: str
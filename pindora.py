@@ -1,72 +1,151 @@
 from Tengan.generate_from_smiles import MoleculeGenerator
-from utils.fetch_data import FetchData
+from Tengan.fingerprints import fingerprint_cache
+from utils.fetch_data import FetchData, OfflineCacheMiss
 from utils.copilot import AzureOpenAIChatClient
+from utils.concurrent_fetch import ConcurrentFetcher
+from utils.stage_pipeline import StagePipeline
+from utils.molecule_registry import MoleculeRegistry
+import os
 import json
-from rdkit import Chem
-from rdkit.Chem import Descriptors, Crippen, AllChem
 from rdkit import DataStructs
 
+MODEL_PATH = "Tengan/res/save_models/ZINC/TenGAN_0.5/rollout_8/batch_64/druglikeness/g_pretrained.pkl"
+
 class Pindora:
-    def __init__(self):
-        self.data_processor = FetchData()
-        self.copilot = AzureOpenAIChatClient()
-        model_path = "Tengan/res/save_models/ZINC/TenGAN_0.5/rollout_8/batch_64/druglikeness/g_pretrained.pkl"
-        self.generator = MoleculeGenerator(
-            model_path=model_path,
+    def __init__(self, data_processor=None, copilot=None, generator=None, fetcher=None):
+        # Components can be injected so a warm set (see utils.model_registry) is shared across requests
+        self.data_processor = data_processor or FetchData()
+        self.copilot = copilot or AzureOpenAIChatClient()
+        self.generator = generator or MoleculeGenerator(
+            model_path=MODEL_PATH,
             batch_size=8,
             max_len=120
         )
-        pass
-    def drug_discovery_pipeline(self, prompt: str):
-        disease_c=self.copilot.generate_desease_name_from_prompt(prompt)
-        diseases=json.loads(disease_c)["desease"]
-        all_data = []
-
-        for disease_name in diseases:
-            efo_ids = self.data_processor.map_disease_to_efo(disease_name)
+        self.fetcher = fetcher or ConcurrentFetcher()
+        self.last_pipeline_stats = None
+        self.last_molecule_report = None
+
+    def resolve_diseases(self, prompt: str) -> list:
+        # Repeat prompts reuse the cached LLM answer, so a warm run needs no network I/O at all
+        cache = getattr(self.data_processor, "cache", None)
+        offline = getattr(self.data_processor, "offline", False)
+        key = cache.make_key("copilot/disease_names", " ".join(prompt.lower().split())) if cache else None
+        diseases = cache.get("disease_names", key, ignore_ttl=True if offline else None) if cache else None
+        if diseases is None:
+            if offline:
+                # Same contract as the other offline lookups: no network, a miss is an error
+                raise OfflineCacheMiss(f"No cached disease names for prompt {prompt!r}")
+            disease_c=self.copilot.generate_desease_name_from_prompt(prompt)
+            diseases=json.loads(disease_c)["desease"]
+            if cache:
+                cache.set("disease_names", key, diseases)
+        return diseases
+
+    def drug_discovery_pipeline(self, prompt: str, output_path: str = "data/generated_molecules_new.json",
+                                nearest_known_drug: bool = False):
+        # Records are appended to the JSON array on disk as they are generated, so a long run
+        # can be followed from the file and a crash keeps everything finished so far
+        gen_mol = []
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            try:
+                for record in self.iter_discovery(prompt, nearest_known_drug=nearest_known_drug):
+                    f.write(",\n" if gen_mol else "\n")
+                    f.write(json.dumps(record, indent=2))
+                    f.flush()
+                    gen_mol.append(record)
+            finally:
+                # Close the array even when the run fails, so the file stays valid JSON
+                f.write("\n]" if gen_mol else "]")
+
+        return gen_mol
+
+    def iter_discovery(self, prompt: str, nearest_known_drug: bool = False, batch_size: int = 100):
+        """Yield each enriched record of the pipeline as soon as its seed has been generated and annotated.
+
+        Fetching, seeding, generation and annotation run as overlapped stages (see
+        utils.stage_pipeline), so sampling starts on the first drug SMILES while later
+        targets are still being fetched. Seeds queued up behind a busy generator are
+        sampled together, up to `batch_size` per packed batch. Stage counters of the
+        last run are kept in `last_pipeline_stats`.
+        """
+        diseases=self.resolve_diseases(prompt)
+
+        # Disease -> EFO IDs
+        efo_lists = self.fetcher.map(self.data_processor.map_disease_to_efo, diseases)
+        efo_pairs = []
+        for disease_name, efo_ids in zip(diseases, efo_lists):
             print(f"Disease: {disease_name} -> EFO IDs: {efo_ids}")
             if not efo_ids:
                 print(f"No EFO ID found for disease: {disease_name}")
-            for efo_id in efo_ids:
-                targets = self.data_processor.get_associated_targets(efo_id, max_targets=50)
-                for t_idx, target in enumerate(targets):
-                    drugs = self.data_processor.get_known_drugs_for_target(target["target_id"], max_drugs=10)
+            efo_pairs.extend((disease_name, efo_id) for efo_id in efo_ids)
+
+        efo_ids = list(dict.fromkeys(efo_id for _, efo_id in efo_pairs))
+        efo_chunk = 10 # EFO IDs per targets call (one aliased document at the default chunk_size)
+
+        def fetch_rows(_):
+            # EFO ID -> associated targets -> known drugs, batched into aliased GraphQL documents. Targets
+            # are fetched for a chunk of EFO IDs at once; each EFO ID's rows still go downstream before
+            # the next one's drugs are fetched
+            targets_by_efo, ic50_by_drug, features_by_drug = {}, {}, {}
+            total = 0
+            for disease_name, efo_id in efo_pairs:
+                if efo_id not in targets_by_efo:
+                    # EFO IDs are visited in order, so this one starts the next unfetched chunk
+                    start = efo_ids.index(efo_id)
+                    targets_by_efo.update(self.data_processor.get_associated_targets_batch(
+                        efo_ids[start:start + efo_chunk], max_targets=50, map_fn=self.fetcher.map))
+                targets = targets_by_efo[efo_id]
+                drugs_by_target = self.data_processor.get_known_drugs_for_targets(
+                    [target["target_id"] for target in targets], max_drugs=10, map_fn=self.fetcher.map)
+                drug_lists = [drugs_by_target[target["target_id"]] for target in targets]
+
+                # Only the first known drug of each target is used; bulk-fetch IC50 and properties once per drug
+                drug_ids = [drug_id for drug_id in dict.fromkeys(drugs[0]["drug_id"] for drugs in drug_lists if drugs)
+                            if drug_id not in ic50_by_drug]
+                if drug_ids:
+                    ic50_by_drug.update(self.data_processor.get_ic50_data_for_molecules(drug_ids, limit=100, map_fn=self.fetcher.map))
+                    features_by_drug.update(self.data_processor.get_molecule_properties_batch(drug_ids, map_fn=self.fetcher.map))
+
+                rows = []
+                for target, drugs in zip(targets, drug_lists):
                     if not drugs:
                         continue
-                    for j, drug in enumerate(drugs):
-                        ic50_data = self.data_processor.get_ic50_data_for_molecule(drug["drug_id"], limit=100)
-                        features = self.data_processor.get_molecule_properties(drug["drug_id"]) or {}
-                        for ic50 in ic50_data:
-                            row = {
-                                "disease_name": disease_name,
-                                "efo_id": efo_id,
-                                
-                                # Target information
-                                "target_id": target["target_id"],
-                                "target_symbol": target["approved_symbol"],
-                                "association_score": target["association_score"],
-                                
-                                # Drug information
-                                "drug_id": drug["drug_id"],
-                                "drug_name": drug["pref_name"],
-                                "clinical_phase": drug["phase"],
-                                
-                                # IC50 bioactivity data
-                                "ic50_value": ic50["standard_value"],
-                                "ic50_units": ic50.get("standard_units"),
-                                "target_chembl_id": ic50.get("target_chembl_id"),
-                                "assay_chembl_id": ic50.get("assay_chembl_id"),
-                                "pchembl_value": ic50.get("pchembl_value")
-                            }
-                            for key, value in features.items():
-                                if key != "molecule_chembl_id" and value is not None:
-                                    row[key] = value
+                    drug = drugs[0]
+                    ic50_data = ic50_by_drug[drug["drug_id"]]
+                    features = features_by_drug[drug["drug_id"]] or {}
+                    if not ic50_data:
+                        continue
+                    ic50 = ic50_data[0]
+                    row = {
+                        "disease_name": disease_name,
+                        "efo_id": efo_id,
 
-                            all_data.append(row)
-                            break
-                        break
+                        # Target information
+                        "target_id": target["target_id"],
+                        "target_symbol": target["approved_symbol"],
+                        "association_score": target["association_score"],
 
-        print(f"Total records collected: {len(all_data)}")
+                        # Drug information
+                        "drug_id": drug["drug_id"],
+                        "drug_name": drug["pref_name"],
+                        "clinical_phase": drug["phase"],
+
+                        # IC50 bioactivity data
+                        "ic50_value": ic50["standard_value"],
+                        "ic50_units": ic50.get("standard_units"),
+                        "target_chembl_id": ic50.get("target_chembl_id"),
+                        "assay_chembl_id": ic50.get("assay_chembl_id"),
+                        "pchembl_value": ic50.get("pchembl_value")
+                    }
+                    for key, value in features.items():
+                        if key != "molecule_chembl_id" and value is not None:
+                            row[key] = value
+
+                    rows.append(row)
+                total += len(rows)
+                yield rows
+            print(f"Total records collected: {total}")
 
         def split_smiles_components(smiles: str) -> list:
             if not smiles or not isinstance(smiles, str):
@@ -80,85 +159,127 @@ class Pindora:
             cleaned = [c.strip() for c in components if c.strip() and len(c.strip()) > 1]
             return cleaned if cleaned else [smiles.strip()]
 
-        def calculate_similarity(smiles1: str, smiles2: str) -> float:
-            try:
-                mol1 = Chem.MolFromSmiles(smiles1)
-                mol2 = Chem.MolFromSmiles(smiles2)
-                if mol1 and mol2:
-                    fp1 = AllChem.GetMorganFingerprintAsBitVect(mol1, 2)
-                    fp2 = AllChem.GetMorganFingerprintAsBitVect(mol2, 2)
-                    return DataStructs.TanimotoSimilarity(fp1, fp2)
-            except:
-                pass
-            return 0.0
-
-        def get_molecular_properties(smiles: str) -> dict:
-            try:
-                mol = Chem.MolFromSmiles(smiles)
-                if mol:
-                    return {
-                        "valid": True,
-                        "molecular_weight": Descriptors.MolWt(mol),
-                        "logp": Crippen.MolLogP(mol),
-                        "hbd": Descriptors.NumHDonors(mol),
-                        "hba": Descriptors.NumHAcceptors(mol),
-                        "rotatable_bonds": Descriptors.NumRotatableBonds(mol),
-                        "aromatic_rings": Descriptors.NumAromaticRings(mol)
-                    }
-            except:
-                pass
-            return {"valid": False}
+        def calculate_similarities(reference_fp, fps: list) -> list:
+            # One BulkTanimotoSimilarity pass per reference; unparseable SMILES score 0.0
+            scores = [0.0] * len(fps)
+            valid = [i for i, fp in enumerate(fps) if fp is not None]
+            if reference_fp is not None and valid:
+                bulk = DataStructs.BulkTanimotoSimilarity(reference_fp, [fps[i] for i in valid])
+                for i, score in zip(valid, bulk):
+                    scores[i] = score
+            return scores
 
-        gen_mol = []
-        for rec in all_data:
-            input_smiles = rec.get("smiles")
-            if not input_smiles:
-                # skip records without a canonical SMILES
-                continue
-            results = self.generator.generate_from_smiles(input_smiles, 5)
-            
-            generated_with_props = []
-            seen = set()  # Track unique molecules
-            
-            for result_smiles in results:
-                components = split_smiles_components(result_smiles)
-                
-                # Create unique identifier from sorted components
-                unique_id = tuple(sorted(components))
-                
-                # Skip if already seen (duplicate)
-                if unique_id in seen:
-                    continue
-                seen.add(unique_id)
+        # Every distinct input drug of the run, for nearest-known-drug lookups
+        known_drugs = {}
+
+        # Generated molecules of the run by canonical SMILES; descriptors are computed once per molecule
+        molecules = MoleculeRegistry()
+        nearest_by_key = {}
+
+        def seed_batches(row_chunks):
+            # Rows without a canonical SMILES are skipped; everything queued so far joins the batch
+            for rows in row_chunks:
+                seeded = []
+                for rec in [row for chunk in [rows] + row_chunks.drain() for row in chunk]:
+                    if not rec.get("smiles"):
+                        continue
+                    seeded.append(rec)
+                    fp = fingerprint_cache.morgan(rec["smiles"], 2, 2048)
+                    if fp is not None and rec["smiles"] not in known_drugs:
+                        known_drugs[rec["smiles"]] = (rec["drug_name"], fp)
+                for start in range(0, len(seeded), batch_size):
+                    yield seeded[start:start + batch_size]
+
+        def generate(batches):
+            for batch in batches:
+                yield batch, self.generator.generate_from_many([rec["smiles"] for rec in batch], 5)
+
+        def annotate(generated):
+            # The nearest-known-drug lookup needs every drug of the run, so that mode waits for fetching to finish
+            pending = list(generated) if nearest_known_drug else generated
+            known_smiles = list(known_drugs)
+            known_fps = [fp for _, fp in known_drugs.values()]
+            for batch, batch_results in pending:
+                for rec, results in zip(batch, batch_results):
+                    input_smiles = rec["smiles"]
                 
-                component_data = []
-                for component in components:
-                    props = get_molecular_properties(component)
-                    similarity = calculate_similarity(input_smiles, component)
-                    component_data.append({
-                        "smiles": component,
-                        "similarity": round(similarity, 3),
-                        "properties": props
-                    })
+                    generated_with_props = []
+                    unique_results = []
+                    seen = set()  # Track unique molecules
                 
-                # append enriched component data (was appending raw components before)
-                generated_with_props.append(component_data)
-            
-            # Only add if there are unique generated molecules
-            if generated_with_props:
-                gen_mol.append({
-                    "input_smile": input_smiles,
-                    "disease_name": rec["disease_name"],
-                    "target_symbol": rec["target_symbol"],
-                    "drug_name": rec["drug_name"],
-                    "generated_molecules": generated_with_props
-                })
+                    for result_smiles in results:
+                        components = split_smiles_components(result_smiles)
+                    
+                        # Create unique identifier from sorted canonical components
+                        unique_id = tuple(sorted(molecules.key(component) for component in components))
+                    
+                        # Skip if already seen (duplicate, however it is written)
+                        if unique_id in seen:
+                            molecules.skip_duplicate()
+                            continue
+                        seen.add(unique_id)
+                        unique_results.append(components)
+
+                    # Fingerprint the input once and score every generated component against it in one pass
+                    all_components = [component for components in unique_results for component in components]
+                    component_fps = [fingerprint_cache.morgan(component, 2, 2048) for component in all_components]
+                    similarities = iter(calculate_similarities(fingerprint_cache.morgan(input_smiles, 2, 2048), component_fps))
+                    component_fps = iter(component_fps)
+                    component_props = iter(molecules.properties(all_components))
+
+                    for components in unique_results:
+                        component_data = []
+                        for component in components:
+                            props = next(component_props)
+                            entry = {
+                                "smiles": component,
+                                "canonical_smiles": molecules.canonical(component),
+                                "similarity": round(next(similarities), 3),
+                                "properties": props
+                            }
+                            fp = next(component_fps)
+                            if nearest_known_drug and fp is not None and known_fps:
+                                key = molecules.key(component)
+                                if key not in nearest_by_key:
+                                    known_scores = DataStructs.BulkTanimotoSimilarity(fp, known_fps)
+                                    best = max(range(len(known_scores)), key=known_scores.__getitem__)
+                                    nearest_by_key[key] = {
+                                        "smiles": known_smiles[best],
+                                        "drug_name": known_drugs[known_smiles[best]][0],
+                                        "similarity": round(known_scores[best], 3)
+                                    }
+                                entry["nearest_known_drug"] = nearest_by_key[key]
+                            component_data.append(entry)
+                    
+                        # append enriched component data (was appending raw components before)
+                        generated_with_props.append(component_data)
                 
-                print(f"\nInput: {input_smiles} (Drug: {rec['drug_name']})")
-                for j, components in enumerate(generated_with_props, 1):
-                    print(f"  Generated {j}: {components}")
-
-        with open("data/generated_molecules_new.json", "w", encoding="utf-8") as f:
-            json.dump(gen_mol, f, indent=2)
-        
-        return gen_mol
\ No newline at end of file
+                    # Only add if there are unique generated molecules
+                    if generated_with_props:
+                        print(f"\nInput: {input_smiles} (Drug: {rec['drug_name']})")
+                        for j, components in enumerate(generated_with_props, 1):
+                            print(f"  Generated {j}: {components}")
+
+                        yield {
+                            "input_smile": input_smiles,
+                            "disease_name": rec["disease_name"],
+                            "target_symbol": rec["target_symbol"],
+                            "drug_name": rec["drug_name"],
+                            "generated_molecules": generated_with_props
+                        }
+
+        pipeline = (StagePipeline(maxsize=int(os.environ.get("PIPELINE_QUEUE_SIZE", 4)))
+                    .add("fetch", fetch_rows)
+                    .add("seed", seed_batches)
+                    .add("generate", generate)
+                    .add("annotate", annotate))
+        try:
+            yield from pipeline.run()
+        finally:
+            self.last_pipeline_stats = pipeline.stats()
+            self.last_molecule_report = molecules.report()
+            print(f"Molecules: {self.last_molecule_report}")
+            for name, stage in self.last_pipeline_stats["stages"].items():
+                print(f"Stage {name}: {stage['items']} items, busy {stage['busy_s']:.2f}s, "
+                      f"starved {stage['wait_s']:.2f}s, blocked {stage['blocked_s']:.2f}s, "
+                      f"max queue depth {stage['max_queue_depth']}")
@@ -1,5 +1,10 @@
-from fastapi import APIRouter
-import json
+from fastapi import APIRouter, HTTPException
+from models.schemas import JobInput
+from utils.model_registry import registry
+from utils.jobs import jobs
+from utils.response_cache import get_response_cache
+from utils.matrix_file import matrix_predictor_stats
+from Tengan.fingerprints import fingerprint_cache
 
 router = APIRouter(
     prefix="/checks",
@@ -8,28 +13,42 @@ router = APIRouter(
 )
 
 @router.post("/status_checks")
-async def process_text():
-    default_status = {"status": "No status set"}
+async def process_text(request: JobInput):
+    """Status of a discovery job; body is `{"job_id": "<id from /api/drug_discovery>"}`, the status is in `message`."""
+    job = jobs.get(request.job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    try:
-        with open("data/status.json", "r", encoding="utf-8") as f:
-            try:
-                status = json.load(f)
-            except json.JSONDecodeError:
-                status = default_status
-                with open("data/status.json", "w", encoding="utf-8") as wf:
-                    json.dump(status, wf)
-    except FileNotFoundError:
-        status = default_status
-        with open("data/status.json", "w", encoding="utf-8") as wf:
-            json.dump(status, wf)
-    status_show=status.get("status")
-    # if status.get("status") == "Molecules Generation Completed":
-    #     status["status"] = "Molecules are not Generating"
-    #     with open("data/status.json", "w", encoding="utf-8") as f:
-    #         json.dump(status, f)
+    return {
+        "status": "success",
+        "job_id": request.job_id,
+        "message": job["status"],
+        "error": job.get("error")
+    }
 
+@router.get("/model_stats")
+async def model_stats():
+    return {
+        "status": "success",
+        "models": registry.stats(),
+        "matrix": matrix_predictor_stats()
+    }
+
+@router.get("/cache_stats")
+async def cache_stats():
+    return {
+        "status": "success",
+        "cache": get_response_cache().stats(),
+        "fingerprints": fingerprint_cache.stats()
+    }
+
+@router.post("/reload_models")
+def reload_models():
+    try:
+        registry.reload()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     return {
         "status": "success",
-        "message": status_show
+        "models": registry.stats()
     }
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
-from models.schemas import TextInput, TextResponse, Generate3DInput, Generate3DResponse
-from pindora import Pindora
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from models.schemas import TextInput, TextResponse, Generate3DInput, Generate3DResponse, JobInput
+from utils.model_registry import registry
+from utils.jobs import jobs, STATUS_COMPLETED
 from utils.generate_3d import Molecule3DGenerator
 import json
+import time
 
 router = APIRouter(
     prefix="/api",
@@ -10,27 +13,70 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+def run_discovery(text: str, output_path: str):
+    start = time.perf_counter()
+    cold = not registry.is_loaded
+    Pindora_instance = registry.get_pindora()
+    mol_gen = Pindora_instance.drug_discovery_pipeline(text, output_path=output_path)
+    registry.record_request(time.perf_counter() - start, cold)
+    return mol_gen
+
 @router.post("/drug_discovery", response_model=TextResponse)
 async def process_text(request: TextInput):
+    """Queue a discovery run and return its `job_id` right away (`results` is always null).
+
+    Poll `POST /checks/status_checks` with `{"job_id": ...}` until the message is
+    "Molecules Generation Completed", then fetch the records from
+    `POST /api/get_discorvery_results` with the same body.
+    """
     if not request.text or len(request.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     print("Received text:", request.text)
-    with open("data/status.json", "w") as f:
-        json.dump({"status": "Molecules Generation in Progress"}, f)
-    
-    Pindora_instance = Pindora()
-    mol_gen = Pindora_instance.drug_discovery_pipeline(request.text)
 
-    with open("data/status.json", "w") as f:
-        json.dump({"status": "Molecules Generation Completed"}, f)
+    # The pipeline runs in the job worker pool; poll /checks/status_checks with the job ID
+    job_id = jobs.submit(run_discovery, request.text)
 
     return {
         "input_text": request.text,
-        "results": mol_gen,
+        "job_id": job_id,
+        "results": None,
         "status": "success",
-        "message": f"Drug discovery pipeline completed. Found {len(mol_gen)} molecules."
+        "message": f"Drug discovery job {job_id} submitted."
     }
 
+def stream_discovery(text: str, sse: bool):
+    # Runs in Starlette's threadpool; each record is sent as soon as the pipeline yields it.
+    # Streams share the DISCOVERY_WORKERS limit with queued jobs, waiting for a free slot.
+    with jobs.slot():
+        start = time.perf_counter()
+        cold = not registry.is_loaded
+        Pindora_instance = registry.get_pindora()
+        try:
+            for record in Pindora_instance.iter_discovery(text):
+                yield f"event: record\ndata: {json.dumps(record)}\n\n" if sse else json.dumps(record) + "\n"
+        except Exception as e:
+            error = {"status": "failed", "error": str(e)}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n" if sse else json.dumps(error) + "\n"
+            return
+        finally:
+            registry.record_request(time.perf_counter() - start, cold)
+    if sse:
+        yield "event: done\ndata: {}\n\n"
+
+@router.post("/drug_discovery/stream")
+async def stream_text(request: TextInput, http_request: Request):
+    """Stream discovery records as NDJSON, or as server-sent events when the client accepts text/event-stream."""
+    if not request.text or len(request.text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    print("Received text (stream):", request.text)
+
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    return StreamingResponse(
+        stream_discovery(request.text, sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/generate-3d", response_model=Generate3DResponse)
 async def generate_3d_endpoint(request: Generate3DInput):
     if not request.input_smile or len(request.input_smile.strip()) == 0:
@@ -51,24 +97,22 @@ async def generate_3d_endpoint(request: Generate3DInput):
     
 
 @router.post("/get_discorvery_results")
-async def get_discovery_results():
-
-    with open("data/status.json", "r") as f:
-        status = json.load(f)
-    if status.get("status") == "Molecules are not Generating" or status.get("status") == "Molecules Generation in Progress":
+async def get_discovery_results(request: JobInput):
+    """Records of a finished discovery job; body is `{"job_id": "<id from /api/drug_discovery>"}`."""
+    job = jobs.get(request.job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != STATUS_COMPLETED:
         return {
             "status": "failed",
-            "results": [status.get("status")],
+            "job_id": request.job_id,
+            "results": [job["status"]],
+            "error": job.get("error"),
         }
-    elif status.get("status") == "Molecules Generation Completed":
-        status["status"] = "Molecules are not Generating"
-        with open("data/status.json", "w") as f:
-            json.dump(status, f)
-    with open("data/generated_molecules_new.json", "r") as f:
-        results = json.load(f)
-
+    results = jobs.get_results(request.job_id)
 
     return {
         "status": "success",
+        "job_id": request.job_id,
         "results": results
     }
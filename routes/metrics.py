@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from models.schemas import Generate3DInput
-from utils.copilot import AzureOpenAIChatClient
-from utils.matrix_file import MatrixPredictor
+from models.schemas import Generate3DInput, SmilesBatchInput
+from utils.copilot import get_chat_client
+from utils.matrix_file import get_matrix_predictor
 
 router = APIRouter(
     prefix="/metrics",
@@ -12,8 +12,8 @@ router = APIRouter(
 @router.post("/metrics_data")
 async def metrics_data(request: Generate3DInput):
 
-    client = AzureOpenAIChatClient()
-    matrix = MatrixPredictor()
+    client = get_chat_client()
+    matrix = get_matrix_predictor()
 
     results = matrix.predict_all(request.input_smile)
 
@@ -25,3 +25,16 @@ async def metrics_data(request: Generate3DInput):
         "report": report,
         "status": "success",
     }
+
+@router.post("/predict_batch")
+def predict_batch(request: SmilesBatchInput):
+    # Score every molecule of a run with one call; invalid SMILES are flagged per row.
+    # A plain def: FastAPI runs it in its threadpool, so the blocking predictions never stall the event loop
+    if not request.smiles:
+        raise HTTPException(status_code=400, detail="At least one SMILES string is required")
+
+    matrix = get_matrix_predictor()
+    return {
+        "results": matrix.predict_all_batch(request.smiles),
+        "status": "success",
+    }
@@ -677,6 +677,80 @@ def get_ic50_data_for_molecule(molecule_chembl_id: str, limit: int = 1000) -> Li
 
     return ic50_records
 
+
+def get_ic50_data_for_molecules(molecule_chembl_ids: List[str], limit: int = 1000,
+                                chunk_size: int = 50) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieve IC50 records for many molecules with a few paged ChEMBL calls.
+
+    Instead of one activity query per drug, molecules are queried in chunks using
+    ChEMBL's `molecule_chembl_id__in` filter and the activities are fanned back
+    out per molecule. Each molecule keeps its first `limit` activities and then drops
+    those without a standard_value, the records one ChEMBL query with `limit` per
+    molecule returns (as FetchData.get_ic50_data_for_molecule does). Molecules that
+    already have `limit` activities are left out of the following pages.
+
+    Args:
+        molecule_chembl_ids (list): ChEMBL molecule identifiers (duplicates are ignored).
+        limit (int, optional): Maximum IC50 records per molecule. Defaults to 1000.
+        chunk_size (int, optional): Molecules per `__in` query. Defaults to 50.
+
+    Returns:
+        dict: Molecule ID -> list of IC50 records (same fields as get_ic50_data_for_molecule).
+
+    Example:
+        >>> ic50_by_drug = get_ic50_data_for_molecules(['CHEMBL941', 'CHEMBL25'], limit=5)
+        >>> len(ic50_by_drug['CHEMBL941'])
+        5
+    """
+    molecule_chembl_ids = list(dict.fromkeys(molecule_chembl_ids))
+    activities_by_molecule = {molecule_chembl_id: [] for molecule_chembl_id in molecule_chembl_ids}
+
+    for start in range(0, len(molecule_chembl_ids), chunk_size):
+        pending = molecule_chembl_ids[start:start + chunk_size]
+
+        while pending:
+            # Every activity of a pending molecule seen so far was kept, so the narrower query resumes at their total
+            offset = sum(len(activities_by_molecule[m]) for m in pending)
+            page_limit = min(1000, sum(limit - len(activities_by_molecule[m]) for m in pending))  # ChEMBL caps pages at 1000 records
+            params = {
+                "molecule_chembl_id__in": ",".join(pending),
+                "standard_type__exact": "IC50",
+                "limit": page_limit,
+                "offset": offset
+            }
+            try:
+                data = query_chembl("activity", params)
+            except Exception as e:
+                print(f"      ❌ Error querying ChEMBL for IC50 data ({len(pending)} molecules): {e}")
+                break
+
+            activities = data.get("activities", [])
+            for activity in activities:
+                # Raw activities count toward `limit`; null values are filtered afterwards
+                rows = activities_by_molecule.get(activity.get("molecule_chembl_id"))
+                if rows is not None and len(rows) < limit:
+                    rows.append(activity)
+
+            # Stop when the results are exhausted; molecules that are full drop out of the next query
+            if not activities or not data.get("page_meta", {}).get("next"):
+                break
+            pending = [m for m in pending if len(activities_by_molecule[m]) < limit]
+
+    return {
+        molecule_chembl_id: [{
+            "molecule_chembl_id": molecule_chembl_id,
+            "standard_value": activity["standard_value"],
+            "standard_units": activity.get("standard_units", "nM"),
+            "target_chembl_id": activity.get("target_chembl_id"),
+            "target_pref_name": activity.get("target_pref_name"),
+            "assay_chembl_id": activity.get("assay_chembl_id"),
+            "pchembl_value": activity.get("pchembl_value"),
+            "document_chembl_id": activity.get("document_chembl_id")
+        } for activity in activities if activity.get("standard_value") is not None]
+        for molecule_chembl_id, activities in activities_by_molecule.items()
+    }
+
 # ============================
 # Step 5: Drug → Molecular Features (ChEMBL)
 # ============================
@@ -686,6 +760,10 @@ def get_molecule_properties(molecule_chembl_id: str) -> Dict[str, Any]:
     # with open(f"{molecule_chembl_id}_raw.json", "w", encoding="utf-8") as f:
     #     json.dump(data, f, indent=2)
     
+    return _molecule_features(data)
+
+
+def _molecule_features(data: Dict[str, Any]) -> Dict[str, Any]:
     props = data.get("molecule_properties", {})
     structs = data.get("molecule_structures", {})
 
@@ -711,6 +789,38 @@ def get_molecule_properties(molecule_chembl_id: str) -> Dict[str, Any]:
         "inchi_key": structs.get("standard_inchi_key"),
         "molfile_preview": structs.get("molfile", "") if structs.get("molfile") else None
     }
+
+
+def get_molecules_properties(molecule_chembl_ids: List[str], chunk_size: int = 50) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch molecular features for many molecules with `molecule_chembl_id__in` queries.
+
+    Returns a dict of molecule ID -> features (same fields as get_molecule_properties).
+    Molecules ChEMBL does not return, or whose chunk failed, map to None.
+    """
+    molecule_chembl_ids = list(dict.fromkeys(molecule_chembl_ids))
+    features = {molecule_chembl_id: None for molecule_chembl_id in molecule_chembl_ids}
+
+    for start in range(0, len(molecule_chembl_ids), chunk_size):
+        chunk = molecule_chembl_ids[start:start + chunk_size]
+        offset = 0
+        while True:
+            params = {"molecule_chembl_id__in": ",".join(chunk), "limit": len(chunk), "offset": offset}
+            try:
+                data = query_chembl("molecule", params)
+            except Exception as e:
+                print(f"      ❌ Error fetching molecular features ({len(chunk)} molecules): {e}")
+                break
+
+            molecules = data.get("molecules", [])
+            for molecule in molecules:
+                if molecule.get("molecule_chembl_id") in features:
+                    features[molecule["molecule_chembl_id"]] = _molecule_features(molecule)
+            if not molecules or not data.get("page_meta", {}).get("next"):
+                break
+            offset += len(molecules)
+
+    return features
     
 # ============================
 # Main Pipeline
@@ -785,7 +895,8 @@ def pipeline(disease_name: str, max_targets: int = 5, max_drugs_per_target: int
     Notes:
         - Progress is printed to console for each step
         - Empty DataFrame is returned if disease name not found
-        - Processing time scales with max_targets × max_drugs_per_target
+        - IC50 data and features are fetched in bulk for all drugs, so request count
+          scales with max_targets rather than max_targets × max_drugs_per_target
         - Typical run: 3 targets × 5 drugs = 15 drugs × ~10 IC50s = ~150 rows
         - Some drugs may have no IC50 data (will be skipped)
         - All data is aggregated before returning (no intermediate files)
@@ -831,21 +942,13 @@ def pipeline(disease_name: str, max_targets: int = 5, max_drugs_per_target: int
                   f"Score: {target['association_score']:.3f}")
 
     # ================================================================================
-    # STEP 3-5: For each target, get drugs, IC50 data, and molecular features
+    # STEP 3: For each target, get known drugs
     # ================================================================================
-    all_data = []  # Master list to store all rows
-    
-    # Iterate through each target
+    drugs_by_target = []  # (target, drugs) pairs in target order
+
     for i, target in enumerate(targets, 1):
-        print(f"\n{'='*80}")
-        print(f"Processing target {i}/{len(targets)}: "
-              f"{target['approved_symbol']} ({target['target_id']})")
-        print(f"{'='*80}")
-        
-        # ----------------------------------------------------------------------------
-        # STEP 3: Fetch known drugs for this target
-        # ----------------------------------------------------------------------------
-        print(f"  STEP 3: Fetching known drugs for target...")
+        print(f"\n  STEP 3: Fetching known drugs for target {i}/{len(targets)}: "
+              f"{target['approved_symbol']} ({target['target_id']})...")
         try:
             drugs = get_known_drugs_for_target(target["target_id"], max_drugs=max_drugs_per_target)
         except Exception as e:
@@ -856,6 +959,26 @@ def pipeline(disease_name: str, max_targets: int = 5, max_drugs_per_target: int
             print(f"  ⚠ No drugs found for this target, skipping...")
             continue
         print(f"  ✓ Found {len(drugs)} drug(s).")
+        drugs_by_target.append((target, drugs))
+
+    # ================================================================================
+    # STEP 4-5: Bulk-fetch IC50 data and molecular features for all drugs at once
+    # ================================================================================
+    # One `__in` query per chunk of drugs instead of two requests per drug
+    drug_ids = list(dict.fromkeys(drug["drug_id"] for _, drugs in drugs_by_target for drug in drugs))
+    print(f"\n  STEP 4: Retrieving IC50 data from ChEMBL for {len(drug_ids)} drug(s)...")
+    ic50_by_drug = get_ic50_data_for_molecules(drug_ids, limit=100)
+    print(f"  STEP 5: Fetching molecular features for {len(drug_ids)} drug(s)...")
+    features_by_drug = get_molecules_properties(drug_ids)
+
+    all_data = []  # Master list to store all rows
+
+    # Iterate through each target
+    for i, (target, drugs) in enumerate(drugs_by_target, 1):
+        print(f"\n{'='*80}")
+        print(f"Processing target {i}/{len(drugs_by_target)}: "
+              f"{target['approved_symbol']} ({target['target_id']})")
+        print(f"{'='*80}")
 
         # Iterate through each drug for this target
         for j, drug in enumerate(drugs, 1):
@@ -864,28 +987,11 @@ def pipeline(disease_name: str, max_targets: int = 5, max_drugs_per_target: int
                   f"{drug['pref_name']} ({drug['drug_id']})")
             print(f"    Clinical Phase: {drug['phase']}")
             print(f"    {'─'*76}")
-            
-            # ------------------------------------------------------------------------
-            # STEP 4: Retrieve IC50 data from ChEMBL
-            # ------------------------------------------------------------------------
-            print(f"      STEP 4: Retrieving IC50 data from ChEMBL...")
-            try:
-                ic50_data = get_ic50_data_for_molecule(drug["drug_id"], limit=100)
-            except Exception as e:
-                print(f"      ❌ Error retrieving IC50 data for {drug['drug_id']}: {e}")
-                continue
-            print(f"      ✓ Found {len(ic50_data)} IC50 record(s).")
 
-            # ------------------------------------------------------------------------
-            # STEP 5: Fetch molecular features/properties
-            # ------------------------------------------------------------------------
-            print(f"      STEP 5: Fetching molecular features...")
-            try:
-                features = get_molecule_properties(drug["drug_id"])
-            except Exception as e:
-                print(f"      ❌ Error fetching molecular features for {drug['drug_id']}: {e}")
-                continue
+            ic50_data = ic50_by_drug.get(drug["drug_id"], [])
+            print(f"      ✓ Found {len(ic50_data)} IC50 record(s).")
 
+            features = features_by_drug.get(drug["drug_id"])
             if not features or not isinstance(features, dict):
                 print(f"      ⚠ No molecular features found for this drug, skipping...")
                 continue
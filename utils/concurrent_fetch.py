@@ -0,0 +1,19 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List
+
+
+class ConcurrentFetcher:
+    """Bounded thread pool for fanning out blocking API lookups.
+
+    Results always come back in input order, so the pipeline output does not
+    depend on which request finishes first. Per-host request rates are
+    enforced separately by `utils.fetch_data.rate_limiter`.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or int(os.environ.get("FETCH_CONCURRENCY", 8))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+
+    def map(self, fn: Callable[[Any], Any], items: Iterable[Any]) -> List[Any]:
+        return list(self._executor.map(fn, items))
@@ -1,5 +1,6 @@
 import os
 import base64
+import threading
 from openai import AzureOpenAI
 import json
 from dotenv import load_dotenv
@@ -292,3 +293,15 @@ that follow Open Targets Platform naming conventions.
         )
 
         return completion.choices[0].message.content
+
+
+_chat_client = None
+_chat_client_lock = threading.Lock()
+
+def get_chat_client() -> AzureOpenAIChatClient:
+    """Process-wide Azure OpenAI client, created on first use and shared across requests."""
+    global _chat_client
+    with _chat_client_lock:
+        if _chat_client is None:
+            _chat_client = AzureOpenAIChatClient()
+        return _chat_client
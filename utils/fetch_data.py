@@ -1,55 +1,155 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import pandas as pd
 from typing import List, Dict, Any, Optional
 import time
+import threading
+from urllib.parse import urlparse
 from utils.copilot import AzureOpenAIChatClient
+from utils.response_cache import ResponseCache, get_response_cache
 
 OPEN_TARGETS_URL = "https://api.platform.opentargets.org/api/v4/graphql"
 CHEMBL_URL = "https://www.ebi.ac.uk/chembl/api/data"
 
-def query_open_targets(query: str, variables: Dict[str, Any] = None, max_retries: int = 3) -> Dict[str, Any]:
-    payload = {"query": query}
-    if variables:
-        payload["variables"] = variables
+# Maximum requests per second sent to each host, shared by all threads
+RATE_LIMITS = {
+    "api.platform.opentargets.org": 10.0,
+    "www.ebi.ac.uk": 5.0,
+}
+
+
+class HostRateLimiter:
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        # Reserve the next free slot for this host, then sleep until it comes up
+        host = urlparse(url).netloc
+        rate = self.rates.get(host)
+        if not rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+rate_limiter = HostRateLimiter(RATE_LIMITS)
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+def _request_json(method: str, url: str, session: Optional[requests.Session] = None, timeout: float = 30,
+                  max_retries: int = 3, backoff: float = 1.0, **kwargs) -> Dict[str, Any]:
+    # Shared retry/backoff for both backends; without a session this falls back to a one-off connection
+    sender = session or requests
     for attempt in range(max_retries):
+        rate_limiter.wait(url)
         try:
-            response = requests.post(OPEN_TARGETS_URL, json=payload, timeout=30)
+            response = sender.request(method, url, timeout=timeout, **kwargs)
             response.raise_for_status()
             data = response.json()
             return data
-            
+
         except requests.exceptions.HTTPError as e:
-            if response.status_code in [502, 503, 504] and attempt < max_retries - 1:
-                wait_time = 2 ** attempt
+            if response.status_code in RETRY_STATUS_CODES and attempt < max_retries - 1:
+                wait_time = backoff * 2 ** attempt
                 time.sleep(wait_time)
                 continue
             else:
                 raise
         except requests.exceptions.RequestException as e:
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
+                wait_time = backoff * 2 ** attempt
                 time.sleep(wait_time)
                 continue
             else:
                 raise
+
+def query_open_targets(query: str, variables: Dict[str, Any] = None, max_retries: int = 3, **kwargs) -> Dict[str, Any]:
+    payload = {"query": query}
+    if variables:
+        payload["variables"] = variables
+    return _request_json("POST", OPEN_TARGETS_URL, json=payload, max_retries=max_retries, **kwargs)
     
 
-def query_chembl(endpoint: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+def query_chembl(endpoint: str, params: Dict[str, Any] = None, max_retries: int = 3, **kwargs) -> Dict[str, Any]:
     if endpoint.endswith(".json"):
         url = f"{CHEMBL_URL}/{endpoint}"
     elif "/" in endpoint and "molecule/" in endpoint:
         url = f"{CHEMBL_URL}/{endpoint}.json"
     else:
         url = f"{CHEMBL_URL}/{endpoint}.json"
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return _request_json("GET", url, params=params, max_retries=max_retries, **kwargs)
+
+
+class OfflineCacheMiss(RuntimeError):
+    pass
 
 
 class FetchData():
-    def __init__(self):
-        pass
+    def __init__(self, pool_size: int = 16, timeout: float = 30, max_retries: int = 3, backoff: float = 1.0,
+                 cache: Optional[ResponseCache] = None, use_cache: bool = True, offline: Optional[bool] = None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # One keep-alive session for every Open Targets / ChEMBL call; pool_size should cover the fetch concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(RATE_LIMITS), pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+        # Responses are served from the on-disk cache when possible; offline mode never touches the network
+        self.cache = (cache or get_response_cache()) if use_cache else None
+        self.offline = offline if offline is not None else os.environ.get("FETCH_OFFLINE") == "1"
+
+    def _request_options(self) -> Dict[str, Any]:
+        return {"session": self.session, "timeout": self.timeout, "max_retries": self.max_retries, "backoff": self.backoff}
+
+    def _cached(self, kind: str, endpoint: str, payload: Any, fetch) -> Dict[str, Any]:
+        if self.cache is None:
+            if self.offline:
+                raise OfflineCacheMiss("Offline mode requires the response cache")
+            return fetch()
+        key = self.cache.make_key(endpoint, payload)
+        # Offline, every stored entry is served whatever its age (the cache may be shared with online clients)
+        data = self.cache.get(kind, key, ignore_ttl=True if self.offline else None)
+        if data is not None:
+            return data
+        if self.offline:
+            raise OfflineCacheMiss(f"No cached {kind} response for {endpoint} {payload}")
+        data = fetch()
+        # GraphQL reports failures in the body; never cache those
+        if not (isinstance(data, dict) and data.get("errors")):
+            self.cache.set(kind, key, data)
+        return data
+
+    def _query_open_targets(self, query: str, variables: Dict[str, Any] = None, kind: str = "open_targets") -> Dict[str, Any]:
+        return self._cached(kind, OPEN_TARGETS_URL, {"query": query, "variables": variables},
+                            lambda: query_open_targets(query, variables, **self._request_options()))
+
+    def _query_chembl(self, endpoint: str, params: Dict[str, Any] = None, kind: str = "chembl") -> Dict[str, Any]:
+        return self._cached(kind, f"{CHEMBL_URL}/{endpoint}", params,
+                            lambda: query_chembl(endpoint, params, **self._request_options()))
+
+    def connection_stats(self) -> Dict[str, int]:
+        # urllib3 keeps per-host counters of opened connections and requests sent over them
+        new_connections, sent = 0, 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            new_connections += pool.num_connections
+            sent += pool.num_requests
+        return {
+            "requests": sent,
+            "new_connections": new_connections,
+            "reused_connections": sent - new_connections
+        }
+
     # ============================
     # Step 1: Disease → EFO ID
     # ============================
@@ -75,7 +175,7 @@ class FetchData():
             "entityNames": ["disease"]
         }
         
-        data = query_open_targets(query, variables)
+        data = self._query_open_targets(query, variables, kind="disease_mapping")
         efo_ids = []
         
         for mapping in data["data"]["mapIds"]["mappings"]:
@@ -114,7 +214,7 @@ class FetchData():
                 "pageSize": page_size
             }
             
-            data = query_open_targets(query, variables)
+            data = self._query_open_targets(query, variables, kind="associated_targets")
             rows = data["data"]["disease"]["associatedTargets"]["rows"]
             
             if not rows:
@@ -132,6 +232,68 @@ class FetchData():
                 break
         return targets[:max_targets]
 
+    def get_associated_targets_batch(self, efo_ids: List[str], max_targets: int = 50, chunk_size: int = 10,
+                                     map_fn=map) -> Dict[str, List[Dict[str, Any]]]:
+        """Associated targets for many EFO IDs, one aliased GraphQL document per chunk and page.
+
+        map_fn runs the chunk queries of a round (e.g. ConcurrentFetcher.map); results are keyed by EFO ID.
+        """
+        efo_ids = list(dict.fromkeys(efo_ids))
+        targets = {efo_id: [] for efo_id in efo_ids}
+        pages = {efo_id: 0 for efo_id in efo_ids}
+        page_size = 50
+
+        pending = efo_ids if max_targets > 0 else []
+        while pending:
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            results = list(map_fn(lambda chunk: self._associated_targets_page(chunk, pages, page_size), chunks))
+            next_pending = []
+            for chunk, chunk_rows in zip(chunks, results):
+                for efo_id, rows in zip(chunk, chunk_rows):
+                    if not rows:
+                        continue
+                    for row in rows:
+                        targets[efo_id].append({
+                            "target_id": row["target"]["id"],
+                            "approved_symbol": row["target"]["approvedSymbol"],
+                            "association_score": row["score"]
+                        })
+                    pages[efo_id] += 1
+                    if len(rows) == page_size and len(targets[efo_id]) < max_targets:
+                        next_pending.append(efo_id)
+            pending = next_pending
+        return {efo_id: rows[:max_targets] for efo_id, rows in targets.items()}
+
+    def _associated_targets_page(self, efo_ids: List[str], pages: Dict[str, int], page_size: int) -> List[Optional[List[Dict[str, Any]]]]:
+        definitions = ["$pageSize: Int!"]
+        fields = []
+        variables = {"pageSize": page_size}
+        for i, efo_id in enumerate(efo_ids):
+            definitions += [f"$efo{i}: String!", f"$page{i}: Int!"]
+            fields.append(f"""
+                d{i}: disease(efoId: $efo{i}) {{
+                    associatedTargets(page: {{ index: $page{i}, size: $pageSize }}) {{
+                        count
+                        rows {{
+                            score
+                            target {{
+                                id
+                                approvedSymbol
+                            }}
+                        }}
+                    }}
+                }}""")
+            variables[f"efo{i}"] = efo_id
+            variables[f"page{i}"] = pages[efo_id]
+        query = f"query AssociatedTargetsBatch({', '.join(definitions)}) {{{''.join(fields)}\n}}"
+
+        data = self._query_open_targets(query, variables, kind="associated_targets")["data"] or {}
+        results = []
+        for i in range(len(efo_ids)):
+            disease = data.get(f"d{i}") or {}
+            results.append((disease.get("associatedTargets") or {}).get("rows"))
+        return results
+
     # ============================
     # Step 3: Target → Known Drugs
     # ============================
@@ -165,7 +327,7 @@ class FetchData():
                 "cursor": cursor
             }
 
-            data = query_open_targets(query, variables)
+            data = self._query_open_targets(query, variables, kind="known_drugs")
             known_drugs = data["data"]["target"]["knownDrugs"]
 
             for row in known_drugs["rows"]:
@@ -179,6 +341,63 @@ class FetchData():
                 break
         return drugs[:max_drugs]
 
+    def get_known_drugs_for_targets(self, target_ids: List[str], max_drugs: int = 50, chunk_size: int = 25,
+                                    map_fn=map) -> Dict[str, List[Dict[str, Any]]]:
+        """Known drugs for many Ensembl IDs, one aliased GraphQL document per chunk.
+
+        Each target follows its own cursor; only targets with more pages to fetch are re-queried.
+        """
+        target_ids = list(dict.fromkeys(target_ids))
+        drugs = {target_id: [] for target_id in target_ids}
+        cursors = {target_id: None for target_id in target_ids}
+        size = min(50, max_drugs)
+
+        pending = target_ids if max_drugs > 0 else []
+        while pending:
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            results = list(map_fn(lambda chunk: self._known_drugs_page(chunk, cursors, size), chunks))
+            next_pending = []
+            for chunk, chunk_drugs in zip(chunks, results):
+                for target_id, known_drugs in zip(chunk, chunk_drugs):
+                    if not known_drugs:
+                        continue
+                    for row in known_drugs["rows"]:
+                        drugs[target_id].append({
+                            "drug_id": row["drugId"],
+                            "pref_name": row["prefName"],
+                            "phase": row["phase"]
+                        })
+                    cursors[target_id] = known_drugs.get("cursor")
+                    if cursors[target_id] and len(drugs[target_id]) < max_drugs:
+                        next_pending.append(target_id)
+            pending = next_pending
+        return {target_id: rows[:max_drugs] for target_id, rows in drugs.items()}
+
+    def _known_drugs_page(self, target_ids: List[str], cursors: Dict[str, Optional[str]], size: int) -> List[Optional[Dict[str, Any]]]:
+        definitions = ["$size: Int!"]
+        fields = []
+        variables = {"size": size}
+        for i, target_id in enumerate(target_ids):
+            definitions += [f"$target{i}: String!", f"$cursor{i}: String"]
+            fields.append(f"""
+                t{i}: target(ensemblId: $target{i}) {{
+                    knownDrugs(size: $size, cursor: $cursor{i}) {{
+                        count
+                        cursor
+                        rows {{
+                            drugId
+                            prefName
+                            phase
+                        }}
+                    }}
+                }}""")
+            variables[f"target{i}"] = target_id
+            variables[f"cursor{i}"] = cursors[target_id]
+        query = f"query KnownDrugsBatch({', '.join(definitions)}) {{{''.join(fields)}\n}}"
+
+        data = self._query_open_targets(query, variables, kind="known_drugs")["data"] or {}
+        return [(data.get(f"t{i}") or {}).get("knownDrugs") for i in range(len(target_ids))]
+
     # ============================
     # Step 4: Drug → IC50 Data (ChEMBL)
     # ============================
@@ -191,7 +410,7 @@ class FetchData():
             "offset": 0
         }
         
-        data = query_chembl("activity", params)
+        data = self._query_chembl("activity", params, kind="ic50")
 
         ic50_records = []
         
@@ -199,26 +418,76 @@ class FetchData():
             if activity.get("standard_value") is None:
                 continue
             
-            ic50_records.append({
-                "molecule_chembl_id": molecule_chembl_id,
-                "standard_value": activity["standard_value"],
-                "standard_units": activity.get("standard_units", "nM"),
-                "target_chembl_id": activity.get("target_chembl_id"),
-                "target_pref_name": activity.get("target_pref_name"),
-                "assay_chembl_id": activity.get("assay_chembl_id"),
-                "pchembl_value": activity.get("pchembl_value"),
-                "document_chembl_id": activity.get("document_chembl_id")
-            })
+            ic50_records.append(self._ic50_record(molecule_chembl_id, activity))
         
         return ic50_records
 
+    def get_ic50_data_for_molecules(self, molecule_chembl_ids: List[str], limit: int = 1000, chunk_size: int = 50,
+                                    map_fn=map) -> Dict[str, List[Dict[str, Any]]]:
+        """IC50 records for many molecules via `molecule_chembl_id__in`, a few paged calls per chunk.
+
+        Each molecule keeps its first `limit` activities, the same records the per-molecule call returns.
+        """
+        molecule_chembl_ids = list(dict.fromkeys(molecule_chembl_ids))
+        chunks = [molecule_chembl_ids[i:i + chunk_size] for i in range(0, len(molecule_chembl_ids), chunk_size)]
+        records = {}
+        for chunk_records in map_fn(lambda chunk: self._ic50_chunk(chunk, limit), chunks):
+            records.update(chunk_records)
+        return {molecule_chembl_id: records[molecule_chembl_id] for molecule_chembl_id in molecule_chembl_ids}
+
+    def _ic50_chunk(self, molecule_chembl_ids: List[str], limit: int) -> Dict[str, List[Dict[str, Any]]]:
+        activities = {molecule_chembl_id: [] for molecule_chembl_id in molecule_chembl_ids}
+        pending = list(molecule_chembl_ids)
+
+        while pending:
+            # Only molecules still short of `limit` are queried. Every activity of theirs up to the
+            # current position has been kept, so their collected count is the offset in the narrower query.
+            offset = sum(len(activities[molecule_chembl_id]) for molecule_chembl_id in pending)
+            page_size = min(1000, sum(limit - len(activities[molecule_chembl_id]) for molecule_chembl_id in pending)) # ChEMBL caps pages at 1000 records
+            params = {
+                "molecule_chembl_id__in": ",".join(pending),
+                "standard_type__exact": "IC50",
+                "limit": page_size,
+                "offset": offset
+            }
+            data = self._query_chembl("activity", params, kind="ic50")
+            page = data.get("activities", [])
+            for activity in page:
+                rows = activities.get(activity.get("molecule_chembl_id"))
+                if rows is not None and len(rows) < limit:
+                    rows.append(activity)
+            # Stop when the result set is exhausted; molecules that reached `limit` drop out of the next query
+            if not page or not (data.get("page_meta") or {}).get("next"):
+                break
+            pending = [molecule_chembl_id for molecule_chembl_id in pending if len(activities[molecule_chembl_id]) < limit]
+
+        return {
+            molecule_chembl_id: [self._ic50_record(molecule_chembl_id, a) for a in rows if a.get("standard_value") is not None]
+            for molecule_chembl_id, rows in activities.items()
+        }
+
+    @staticmethod
+    def _ic50_record(molecule_chembl_id: str, activity: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "molecule_chembl_id": molecule_chembl_id,
+            "standard_value": activity["standard_value"],
+            "standard_units": activity.get("standard_units", "nM"),
+            "target_chembl_id": activity.get("target_chembl_id"),
+            "target_pref_name": activity.get("target_pref_name"),
+            "assay_chembl_id": activity.get("assay_chembl_id"),
+            "pchembl_value": activity.get("pchembl_value"),
+            "document_chembl_id": activity.get("document_chembl_id")
+        }
+
     # ============================
     # Step 5: Drug → Molecular Features (ChEMBL)
     # ============================
 
     def get_molecule_properties(self, molecule_chembl_id: str) -> Dict[str, Any]:
         try:
-            data = query_chembl(f"molecule/{molecule_chembl_id}")
+            data = self._query_chembl(f"molecule/{molecule_chembl_id}", kind="molecule")
+        except OfflineCacheMiss:
+            raise # A missing snapshot entry must stay visible, not turn into an empty record
         except Exception as e:
             print(f"Error fetching molecule {molecule_chembl_id}: {e}")
             return None
@@ -229,6 +498,45 @@ class FetchData():
         # with open(f"{molecule_chembl_id}_raw.json", "w", encoding="utf-8") as f:
         #     json.dump(data, f, indent=2)
         
+        return self._molecule_properties(data)
+
+    def get_molecule_properties_batch(self, molecule_chembl_ids: List[str], chunk_size: int = 50,
+                                      map_fn=map) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Molecule records for many IDs via `molecule_chembl_id__in`; missing or failed IDs map to None."""
+        molecule_chembl_ids = list(dict.fromkeys(molecule_chembl_ids))
+        chunks = [molecule_chembl_ids[i:i + chunk_size] for i in range(0, len(molecule_chembl_ids), chunk_size)]
+        properties = {}
+        for chunk_properties in map_fn(self._molecule_chunk, chunks):
+            properties.update(chunk_properties)
+        return {molecule_chembl_id: properties[molecule_chembl_id] for molecule_chembl_id in molecule_chembl_ids}
+
+    def _molecule_chunk(self, molecule_chembl_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        molecules = []
+        offset = 0
+        try:
+            while True:
+                params = {
+                    "molecule_chembl_id__in": ",".join(molecule_chembl_ids),
+                    "limit": len(molecule_chembl_ids),
+                    "offset": offset
+                }
+                data = self._query_chembl("molecule", params, kind="molecule")
+                page = data.get("molecules", [])
+                molecules.extend(page)
+                offset += len(page)
+                if not page or not (data.get("page_meta") or {}).get("next"):
+                    break
+        except OfflineCacheMiss:
+            raise # A missing snapshot entry must stay visible, not turn into empty records
+        except Exception as e:
+            print(f"Error fetching molecules {molecule_chembl_ids}: {e}")
+            return {molecule_chembl_id: None for molecule_chembl_id in molecule_chembl_ids}
+
+        by_id = {data.get("molecule_chembl_id"): self._molecule_properties(data) for data in molecules}
+        return {molecule_chembl_id: by_id.get(molecule_chembl_id) for molecule_chembl_id in molecule_chembl_ids}
+
+    @staticmethod
+    def _molecule_properties(data: Dict[str, Any]) -> Dict[str, Any]:
         props = data.get("molecule_properties", {})
         structs = data.get("molecule_structures", {})
         
@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import time
+import uuid
+import threading
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional
+
+JOBS_DIR = "data/jobs"
+
+STATUS_QUEUED = "Molecules Generation Queued"
+STATUS_RUNNING = "Molecules Generation in Progress"
+STATUS_COMPLETED = "Molecules Generation Completed"
+STATUS_FAILED = "Molecules Generation Failed"
+
+
+class JobManager:
+    """Runs drug discovery pipelines in a bounded worker pool.
+
+    Every job gets its own directory under `jobs_dir` holding `status.json`
+    and `results.json`, so concurrent runs never share state files. Finished
+    jobs are kept for `max_age_s` seconds and at most `max_jobs` of them, both
+    in memory and on disk; older ones are evicted when a new job is submitted.
+    """
+
+    def __init__(self, max_workers: int = 2, jobs_dir: str = JOBS_DIR, max_jobs: int = 500,
+                 max_age_s: float = 7 * 24 * 3600):
+        self.jobs_dir = jobs_dir
+        self.max_jobs = max_jobs
+        self.max_age_s = max_age_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="discovery")
+        # Pipeline runs in progress, jobs and streamed requests alike, never exceed max_workers
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def results_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir(job_id), "results.json")
+
+    def _write_json(self, path: str, data: Any) -> None:
+        # Write to a temp file and rename so readers never see a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            snapshot = dict(job)
+        self._write_json(os.path.join(self.job_dir(job_id), "status.json"), snapshot)
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> str:
+        """Queue `fn(*args, output_path=<job results path>, **kwargs)` and return its job ID."""
+        self._evict()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        with self._lock:
+            self._jobs[job_id] = {"job_id": job_id, "created_at": time.time()}
+        self._update(job_id, status=STATUS_QUEUED)
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the max_workers pipeline slots, waiting for a free one."""
+        with self._slots:
+            yield
+
+    def _run(self, job_id: str, fn: Callable[..., Any], args, kwargs) -> None:
+        with self.slot():
+            self._run_job(job_id, fn, args, kwargs)
+
+    def _run_job(self, job_id: str, fn: Callable[..., Any], args, kwargs) -> None:
+        start = time.perf_counter()
+        self._update(job_id, status=STATUS_RUNNING, started_at=time.time())
+        try:
+            results = fn(*args, output_path=self.results_path(job_id), **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=STATUS_FAILED, error=str(e), duration_s=time.perf_counter() - start)
+            return
+        self._update(job_id, status=STATUS_COMPLETED, num_results=len(results), duration_s=time.perf_counter() - start)
+
+    def _evict(self) -> None:
+        # Directories on disk include jobs of earlier processes and of other workers
+        with self._lock:
+            active = {job_id for job_id, job in self._jobs.items()
+                      if job.get("status") in (STATUS_QUEUED, STATUS_RUNNING)}
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return
+        finished = []
+        for name in names:
+            path = self.job_dir(name)
+            if name in active or not os.path.isdir(path):
+                continue
+            finished.append((os.path.getmtime(path), name))
+        finished.sort(reverse=True)
+        cutoff = time.time() - self.max_age_s
+        for rank, (mtime, name) in enumerate(finished):
+            if rank < self.max_jobs and mtime >= cutoff:
+                continue
+            status = (self.get(name) or {}).get("status")
+            if mtime >= cutoff and status in (STATUS_QUEUED, STATUS_RUNNING):
+                continue # Still running in another worker process
+            shutil.rmtree(self.job_dir(name), ignore_errors=True)
+            with self._lock:
+                self._jobs.pop(name, None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if job_id in self._jobs:
+                return dict(self._jobs[job_id])
+        # Jobs submitted by another worker process are only known on disk
+        path = os.path.join(self.job_dir(os.path.basename(job_id)), "status.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get_results(self, job_id: str) -> Any:
+        with open(self.results_path(os.path.basename(job_id)), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+jobs = JobManager(
+    max_workers=int(os.environ.get("DISCOVERY_WORKERS", 2)),
+    max_jobs=int(os.environ.get("DISCOVERY_JOBS_KEEP", 500)),
+    max_age_s=float(os.environ.get("DISCOVERY_JOBS_MAX_AGE_S", 7 * 24 * 3600)),
+)
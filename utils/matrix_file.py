@@ -1,16 +1,69 @@
+import os
+import time
 import joblib
+import threading
 import numpy as np
+import multiprocessing as mp
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
-
-from rdkit import Chem
-from rdkit.Chem import rdFingerprintGenerator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from Tengan.fingerprints import fingerprint_cache
+
+# Lists at least this long are fingerprinted in a process pool
+PARALLEL_FP_THRESHOLD = 2000
+
+_fp_pool: Optional[ProcessPoolExecutor] = None
+_fp_pool_lock = threading.Lock()
+
+
+def _get_fp_pool() -> ProcessPoolExecutor:
+    """Long-lived fingerprint pool shared by every request.
+
+    Workers are spawned rather than forked: the server is multithreaded, and a
+    forked child could inherit locks (e.g. fingerprint_cache's) held by another thread.
+    """
+    global _fp_pool
+    with _fp_pool_lock:
+        if _fp_pool is None:
+            workers = int(os.environ.get("FP_WORKERS", os.cpu_count() or 1))
+            _fp_pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+        return _fp_pool
+
+
+def _rss_bytes() -> Optional[int]:
+    """Current resident set size of this process (Linux /proc), or None if unavailable."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _fingerprint_chunk(args: Tuple[List[str], int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Fingerprint a chunk of SMILES into a (n, fp_size) uint8 matrix plus a validity mask."""
+    smiles_list, radius, fp_size = args
+    X = np.zeros((len(smiles_list), fp_size), dtype=np.uint8)
+    valid = np.zeros(len(smiles_list), dtype=bool)
+    for i, smiles in enumerate(smiles_list):
+        fp = fingerprint_cache.morgan_numpy(smiles, radius, fp_size) if smiles else None
+        if fp is None:
+            continue
+        X[i] = fp
+        valid[i] = True
+    return X, valid
 
 
 class MatrixPredictor:
-    def __init__(self, model_dir: Optional[Union[str, Path]] = None):
+    def __init__(self, model_dir: Optional[Union[str, Path]] = None, mmap_mode: Optional[str] = None):
         # Resolve model directory
         self.model_dir = Path(model_dir) if model_dir else Path(__file__).parent.parent
+        # joblib memory-maps numpy arrays of uncompressed bundles instead of copying them
+        self.mmap_mode = mmap_mode
+        self.load_stats: Dict[str, Dict[str, Any]] = {}
 
         # Load model bundles
         self.ic50_bundle = self._load_bundle("matriX_model/ic50.pkl")
@@ -22,25 +75,48 @@ class MatrixPredictor:
         self.radius = self.ic50_bundle["radius"]
         self.fp_size = self.ic50_bundle["fp_size"]
 
-        self.morgan_gen = rdFingerprintGenerator.GetMorganGenerator(
-            radius=self.radius,
-            fpSize=self.fp_size
-        )
-
     def _load_bundle(self, relative_path: str) -> Dict[str, Any]:
         path = self.model_dir / relative_path
         if not path.exists():
             raise FileNotFoundError(f"Model file not found: {path}")
 
-        return joblib.load(path)
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        bundle = joblib.load(path, mmap_mode=self.mmap_mode)
+        rss_after = _rss_bytes()
+        self.load_stats[path.stem] = {
+            "load_seconds": time.perf_counter() - start,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            "file_bytes": path.stat().st_size,
+        }
+        return bundle
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mmap_mode": self.mmap_mode,
+            "bundles": self.load_stats,
+            "load_seconds": sum(s["load_seconds"] for s in self.load_stats.values()),
+            "rss_bytes": _rss_bytes(),
+        }
 
     def smiles_to_fp(self, smiles: str) -> np.ndarray:
-        mol = Chem.MolFromSmiles(smiles)
-        if mol is None:
+        fp = fingerprint_cache.morgan_numpy(smiles, self.radius, self.fp_size)
+        if fp is None:
             raise ValueError("Invalid SMILES")
 
-        fp = self.morgan_gen.GetFingerprint(mol)
-        return np.array(fp).reshape(1, -1)
+        return fp.reshape(1, -1)
+
+    def smiles_to_fp_matrix(self, smiles_list: List[str], n_jobs: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Fingerprint a list into one contiguous matrix; invalid SMILES get a zero row and valid=False."""
+        n_jobs = n_jobs or os.cpu_count() or 1
+        if len(smiles_list) < PARALLEL_FP_THRESHOLD or n_jobs == 1:
+            return _fingerprint_chunk((smiles_list, self.radius, self.fp_size))
+
+        chunk_size = -(-len(smiles_list) // n_jobs)
+        chunks = [(smiles_list[i:i + chunk_size], self.radius, self.fp_size)
+                  for i in range(0, len(smiles_list), chunk_size)]
+        results = list(_get_fp_pool().map(_fingerprint_chunk, chunks))
+        return np.concatenate([X for X, _ in results]), np.concatenate([valid for _, valid in results])
 
     # ---------------- Predictions ---------------- #
 
@@ -88,4 +164,52 @@ class MatrixPredictor:
             "Predicted_Target": str(target)
         }
 
-print(MatrixPredictor().predict_all("CC(=O)NC1=CC=C(O)C=C1"))
\ No newline at end of file
+    def predict_all_batch(self, smiles_list: List[str], n_jobs: Optional[int] = None) -> List[Dict[str, Any]]:
+        """`predict_all` for a list of SMILES, running each model once on the whole fingerprint matrix.
+
+        Results are in input order; invalid SMILES are returned with valid=False instead of raising.
+        """
+        X, valid = self.smiles_to_fp_matrix(list(smiles_list), n_jobs=n_jobs)
+        results = [
+            {"SMILES": smiles, "valid": False, "error": "Invalid SMILES"}
+            for smiles in smiles_list
+        ]
+        if not valid.any():
+            return results
+
+        X_valid = X[valid]
+        log_ic50 = np.asarray(self.ic50_bundle["model"].predict(X_valid)).ravel()
+        log_assoc = np.asarray(self.assoc_bundle["model"].predict(X_valid)).ravel()
+        phase = np.asarray(self.phase_bundle["model"].predict(X_valid)).ravel()
+        target_idx = np.asarray(self.target_bundle["model"].predict(X_valid)).ravel().astype(int)
+        targets = self.target_bundle["label_encoder"].inverse_transform(target_idx)
+
+        for j, i in enumerate(np.flatnonzero(valid)):
+            results[i] = {
+                "SMILES": smiles_list[i],
+                "valid": True,
+                "IC50": float(10 ** log_ic50[j]),
+                "Association_Score": float(10 ** log_assoc[j]),
+                "Max_Clinical_Phase": int(phase[j]),
+                "Predicted_Target": str(targets[j])
+            }
+        return results
+
+_matrix_predictor: Optional[MatrixPredictor] = None
+_matrix_predictor_lock = threading.Lock()
+
+def get_matrix_predictor() -> MatrixPredictor:
+    """Process-wide predictor, loaded on first use (MATRIX_MMAP=1 memory-maps the bundles)."""
+    global _matrix_predictor
+    with _matrix_predictor_lock:
+        if _matrix_predictor is None:
+            _matrix_predictor = MatrixPredictor(mmap_mode="r" if os.environ.get("MATRIX_MMAP") == "1" else None)
+            print(f"MatrixPredictor loaded: {_matrix_predictor.stats()}")
+        return _matrix_predictor
+
+def matrix_predictor_stats() -> Optional[Dict[str, Any]]:
+    return _matrix_predictor.stats() if _matrix_predictor is not None else None
+
+
+if __name__ == "__main__":
+    print(get_matrix_predictor().predict_all("CC(=O)NC1=CC=C(O)C=C1"))
\ No newline at end of file
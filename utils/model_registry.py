@@ -0,0 +1,112 @@
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from pindora import Pindora, MODEL_PATH
+from utils.fetch_data import FetchData
+from utils.copilot import AzureOpenAIChatClient
+from Tengan.generate_from_smiles import MoleculeGenerator
+
+
+class ModelRegistry:
+    """Application-lifetime holder of the warm Pindora components.
+
+    The generator checkpoint, tokenizer and API clients are built once (at
+    FastAPI startup or on first use) and shared by every request until
+    `reload()` swaps in a freshly loaded set.
+    """
+
+    def __init__(self, model_path: str = MODEL_PATH, batch_size: int = 8, max_len: int = 120):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self._lock = threading.Lock()
+        # Request counters are updated from concurrent request threads; a separate lock so they never wait on a reload
+        self._stats_lock = threading.Lock()
+        self._pindora: Optional[Pindora] = None
+
+        # Timing metrics
+        self.load_times: Dict[str, float] = {}
+        self.loaded_at: Optional[float] = None
+        self.load_count = 0
+        self.requests = {
+            "cold": {"count": 0, "total_seconds": 0.0},
+            "warm": {"count": 0, "total_seconds": 0.0},
+        }
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._pindora is not None
+
+    def _build(self) -> Pindora:
+        load_times = {}
+
+        start = time.perf_counter()
+        data_processor = FetchData()
+        load_times["fetch_data"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        copilot = AzureOpenAIChatClient()
+        load_times["copilot"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        generator = MoleculeGenerator(
+            model_path=self.model_path,
+            batch_size=self.batch_size,
+            max_len=self.max_len
+        )
+        load_times["generator"] = time.perf_counter() - start
+
+        load_times["total"] = sum(load_times.values())
+        self.load_times = load_times
+        return Pindora(data_processor=data_processor, copilot=copilot, generator=generator)
+
+    def load(self) -> Pindora:
+        with self._lock:
+            if self._pindora is None:
+                self._pindora = self._build()
+                self.loaded_at = time.time()
+                self.load_count += 1
+                print(f"Models loaded in {self.load_times['total']:.2f}s: {self.load_times}")
+            return self._pindora
+
+    def reload(self) -> Pindora:
+        # Build the new set before swapping so in-flight requests keep the old one
+        with self._lock:
+            pindora = self._build()
+            self._pindora = pindora
+            self.loaded_at = time.time()
+            self.load_count += 1
+            print(f"Models reloaded in {self.load_times['total']:.2f}s: {self.load_times}")
+            return pindora
+
+    def get_pindora(self) -> Pindora:
+        return self._pindora or self.load()
+
+    def record_request(self, seconds: float, cold: bool) -> None:
+        with self._stats_lock:
+            bucket = self.requests["cold" if cold else "warm"]
+            bucket["count"] += 1
+            bucket["total_seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        requests = {}
+        with self._stats_lock:
+            for kind, bucket in self.requests.items():
+                requests[kind] = {
+                    "count": bucket["count"],
+                    "avg_latency_s": bucket["total_seconds"] / bucket["count"] if bucket["count"] else None,
+                }
+        return {
+            "loaded": self.is_loaded,
+            "loaded_at": self.loaded_at,
+            "load_count": self.load_count,
+            "load_times_s": self.load_times,
+            "requests": requests,
+            "http": self._pindora.data_processor.connection_stats() if self._pindora else None,
+            "pipeline": self._pindora.last_pipeline_stats if self._pindora else None,
+            "molecules": self._pindora.last_molecule_report if self._pindora else None,
+        }
+
+
+registry = ModelRegistry()
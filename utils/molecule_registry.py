@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from Tengan.fingerprints import fingerprint_cache
+from Tengan.descriptors import descriptor_engine
+
+# Descriptor columns reported for every generated molecule, with their JSON types
+PROPERTY_COLUMNS = {
+    "molecular_weight": float,
+    "logp": float,
+    "hbd": int,
+    "hba": int,
+    "rotatable_bonds": int,
+    "aromatic_rings": int
+}
+
+
+class MoleculeRegistry:
+    """Run-scoped registry of generated molecules keyed on canonical SMILES.
+
+    Every record of a discovery run looks its molecules up here, so a molecule
+    generated in several spellings or from several seed drugs is parsed and
+    described once and all records share the same property entry. Unparseable
+    SMILES are keyed on the raw string. `report()` counts the work this saved.
+    """
+
+    def __init__(self, property_columns: Dict[str, type] = PROPERTY_COLUMNS, engine=None):
+        self.property_columns = property_columns
+        self.engine = engine or descriptor_engine
+        self._properties: Dict[str, Dict[str, Any]] = {}
+        self._records: Dict[str, int] = {}
+        self.lookups = 0
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._properties)
+
+    def key(self, smiles: str) -> str:
+        return fingerprint_cache.canonical(smiles) or smiles
+
+    def canonical(self, smiles: str) -> Optional[str]:
+        return fingerprint_cache.canonical(smiles)
+
+    def skip_duplicate(self) -> None:
+        """Count a generated output dropped because its record already has that molecule."""
+        self.duplicates += 1
+
+    def properties(self, smiles_list: List[str]) -> List[Dict[str, Any]]:
+        """Property dicts of one record's molecules in input order; only unseen molecules reach the engine."""
+        keys = [self.key(smiles) for smiles in smiles_list]
+        missing = {}
+        for smiles, key in zip(smiles_list, keys):
+            if key not in self._properties:
+                missing.setdefault(key, smiles)
+        if missing:
+            columns = self.engine.compute(list(missing.values()), self.property_columns)
+            for i, key in enumerate(missing):
+                if not columns["valid"][i] or any(np.isnan(columns[name][i]) for name in self.property_columns):
+                    self._properties[key] = {"valid": False}
+                    continue
+                props = {"valid": True}
+                props.update({name: cast(columns[name][i]) for name, cast in self.property_columns.items()})
+                self._properties[key] = props
+
+        self.lookups += len(keys)
+        for key in set(keys):
+            self._records[key] = self._records.get(key, 0) + 1
+        return [self._properties[key] for key in keys]
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "molecules": self.lookups,
+            "unique_molecules": len(self._properties),
+            "descriptor_passes_saved": self.lookups - len(self._properties),
+            "shared_across_records": sum(1 for count in self._records.values() if count > 1),
+            "duplicate_outputs_skipped": self.duplicates,
+        }
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = "data/cache/responses.sqlite"
+
+# Seconds before a cached response of each query type is refetched
+DEFAULT_TTLS = {
+    "disease_names": 30 * 24 * 3600,
+    "disease_mapping": 30 * 24 * 3600,
+    "associated_targets": 7 * 24 * 3600,
+    "known_drugs": 7 * 24 * 3600,
+    "ic50": 30 * 24 * 3600,
+    "molecule": 30 * 24 * 3600,
+}
+DEFAULT_TTL = 24 * 3600
+
+
+class ResponseCache:
+    """Content-addressed SQLite cache for Open Targets / ChEMBL responses.
+
+    Entries are keyed on the endpoint plus the normalized query, expire per
+    query type, and are evicted least-recently-used once the stored payloads
+    exceed `max_bytes`. With `ignore_ttl=True` every stored entry is served,
+    which is how a pre-warmed snapshot is used offline.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 256 * 1024 * 1024,
+                 ttls: Optional[Dict[str, float]] = None, ignore_ttl: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.ignore_ttl = ignore_ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+        self._kind_stats: Dict[str, Dict[str, int]] = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, kind TEXT, value TEXT, size INTEGER, created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(endpoint: str, payload: Any) -> str:
+        # GraphQL documents are whitespace-insensitive; dict ordering must not change the key
+        if isinstance(payload, dict) and isinstance(payload.get("query"), str):
+            payload = dict(payload, query=" ".join(payload["query"].split()))
+        normalized = json.dumps({"endpoint": endpoint, "payload": payload}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _count(self, kind: str, field: str) -> None:
+        self._stats[field] += 1
+        kind_stats = self._kind_stats.setdefault(kind, {"hits": 0, "misses": 0})
+        if field in kind_stats:
+            kind_stats[field] += 1
+
+    def get(self, kind: str, key: str, ignore_ttl: Optional[bool] = None) -> Optional[Any]:
+        """Cached value, or None if missing or expired; `ignore_ttl` overrides the cache-wide setting."""
+        ignore_ttl = self.ignore_ttl if ignore_ttl is None else ignore_ttl
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(kind, "misses")
+                return None
+            value, created_at = row
+            if not ignore_ttl and now - created_at > self.ttls.get(kind, DEFAULT_TTL):
+                self._count(kind, "expired")
+                self._count(kind, "misses")
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._count(kind, "hits")
+        return json.loads(value)
+
+    def set(self, kind: str, key: str, value: Any) -> None:
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._bytes += len(data) - (old[0] if old else 0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, data, len(data), now, now)
+            )
+            self._stats["stores"] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until the payloads fit in 90% of max_bytes
+        if self._bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if self._bytes <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._bytes -= size
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self._stats)
+            by_kind = {kind: dict(counts) for kind, counts in self._kind_stats.items()}
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "hit_rate": stats["hits"] / lookups if lookups else None,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "by_kind": by_kind,
+        })
+        return stats
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache, opened on first use (RESPONSE_CACHE_PATH, FETCH_OFFLINE)."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                path=os.environ.get("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH),
+                ignore_ttl=os.environ.get("FETCH_OFFLINE") == "1"
+            )
+        return _response_cache
@@ -0,0 +1,157 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+_DONE = object()
+_EMPTY = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class StageInput:
+    """Items handed to a stage by the stage before it, in order.
+
+    Iterating blocks until the next item arrives; `drain()` takes whatever is
+    already queued without waiting, so a stage can batch up a backlog.
+    """
+
+    def __init__(self, source: Optional[queue.Queue], stats: Dict[str, Any], stop: threading.Event):
+        self._queue = source
+        self._stats = stats
+        self._stop = stop
+        self.closed = source is None
+
+    def _get(self, block: bool) -> Any:
+        while True:
+            try:
+                return self._queue.get(timeout=0.1) if block else self._queue.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return _EMPTY
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def __iter__(self) -> Iterator[Any]:
+        while not self.closed:
+            start = time.perf_counter()
+            item = self._get(True)
+            self._stats["wait_s"] += time.perf_counter() - start
+            if item is _DONE:
+                self.closed = True
+                return
+            yield item
+
+    def drain(self, limit: Optional[int] = None) -> List[Any]:
+        items = []
+        while not self.closed and (limit is None or len(items) < limit):
+            item = self._get(False)
+            if item is _EMPTY:
+                break
+            if item is _DONE:
+                self.closed = True
+                break
+            items.append(item)
+        return items
+
+
+class StagePipeline:
+    """Producer/consumer stages, each in its own thread, connected by bounded queues.
+
+    A stage is `fn(inputs) -> iterable of outputs`, where `inputs` is the
+    StageInput fed by the previous stage (empty for the first one). Items keep
+    their order end to end. A full queue blocks the stage feeding it, so a slow
+    stage throttles everything upstream instead of buffering without bound.
+
+    Per stage, `stats()` reports busy time (working, not waiting), time starved
+    for input, time blocked on a full output queue, and the depth of its output
+    queue: the bottleneck is the stage that is busy while its input queue is full.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self._stages: List[tuple] = []
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._elapsed = 0.0
+
+    def add(self, name: str, fn: Callable[[StageInput], Iterable[Any]]) -> "StagePipeline":
+        self._stages.append((name, fn))
+        return self
+
+    def _put(self, target: queue.Queue, item: Any) -> None:
+        while True:
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _run_stage(self, name: str, fn: Callable[[StageInput], Iterable[Any]], inputs: StageInput,
+                   target: queue.Queue) -> None:
+        stats = self._stats[name]
+        start = time.perf_counter()
+        try:
+            for item in fn(inputs):
+                put_start = time.perf_counter()
+                self._put(target, item)
+                stats["blocked_s"] += time.perf_counter() - put_start
+                stats["items"] += 1
+                depth = target.qsize()
+                stats["max_queue_depth"] = max(stats["max_queue_depth"], depth)
+                stats["_depth_total"] += depth
+        except _Stopped:
+            pass
+        except BaseException as e:
+            with self._lock:
+                self._error = self._error or e
+            self._stop.set()
+        finally:
+            stats["busy_s"] = time.perf_counter() - start - stats["wait_s"] - stats["blocked_s"]
+            try:
+                self._put(target, _DONE)
+            except _Stopped:
+                pass
+
+    def run(self) -> Iterator[Any]:
+        """Start every stage and yield the outputs of the last one as they arrive."""
+        self._stop.clear()
+        self._error = None
+        self._stats = {name: {"items": 0, "busy_s": 0.0, "wait_s": 0.0, "blocked_s": 0.0,
+                              "max_queue_depth": 0, "_depth_total": 0} for name, _ in self._stages}
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in self._stages]
+        threads = []
+        for i, (name, fn) in enumerate(self._stages):
+            inputs = StageInput(queues[i - 1] if i else None, self._stats[name], self._stop)
+            thread = threading.Thread(target=self._run_stage, args=(name, fn, inputs, queues[i]),
+                                      name=f"stage-{name}", daemon=True)
+            threads.append(thread)
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            # The caller consumes the last queue; stopping early (e.g. a closed stream) stops every stage
+            yield from StageInput(queues[-1], {"wait_s": 0.0}, self._stop)
+        except _Stopped:
+            pass
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._elapsed = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+
+    def stats(self) -> Dict[str, Any]:
+        stages = {}
+        for name, stats in self._stats.items():
+            stages[name] = {key: value for key, value in stats.items() if not key.startswith("_")}
+            stages[name]["avg_queue_depth"] = stats["_depth_total"] / stats["items"] if stats["items"] else 0.0
+            stages[name]["utilization"] = stats["busy_s"] / self._elapsed if self._elapsed else None
+        return {"elapsed_s": self._elapsed, "queue_size": self.maxsize, "stages": stages}